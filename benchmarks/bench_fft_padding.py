@@ -0,0 +1,103 @@
+"""Full record transforms at awkward record lengths, with and without the fft_padding policy.
+
+Record lengths from ``time_to_take * sample_rate`` often have large prime factors. For each length the raw
+``fft``/``rfft`` cost is compared with the next fast length, and ``carrier_filter`` followed by
+``velocity_calculation`` is timed with ``fft_padding="none"`` and ``"pad"``.
+
+Run from the repository root with ``python benchmarks/bench_fft_padding.py``.
+"""
+
+import time
+import numpy as np
+from scipy.fft import fft, rfft, next_fast_len
+from alpss.carrier.filter import carrier_filter
+from alpss.velocity.calculation import velocity_calculation
+
+
+def best_of(func, *args, repeat=5, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def largest_prime_factor(n):
+    factor, largest = 2, 1
+    while factor * factor <= n:
+        while n % factor == 0:
+            largest, n = factor, n // factor
+        factor += 1
+    return max(largest, n) if n > 1 else largest
+
+
+def record(fs, n, rng):
+    # a 2.2 GHz carrier that ramps up in frequency after a third of the record, with noise
+    time_s = np.arange(n) / fs
+    t_start = time_s[n // 3]
+    ramp = np.where(time_s > t_start, 0.5e9 * (time_s - t_start) / 100e-9, 0.0)
+    voltage = np.sin(2 * np.pi * np.cumsum(2.2e9 + ramp) / fs) + 0.01 * rng.standard_normal(n)
+    return {
+        "time": time_s,
+        "voltage": voltage,
+        "fs": fs,
+        "t_start_corrected": t_start,
+        "t_doi_start": t_start - 5e-9,
+        "t_doi_end": t_start + 200e-9,
+    }
+
+
+def chain(sdf_out, **inputs):
+    cf_out = carrier_filter(sdf_out, 2.2e9, **inputs)
+    return velocity_calculation(sdf_out, 2.2e9, cf_out, **inputs)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    fs = 80e9
+    inputs = {
+        "carrier_filter_type": "gaussian_notch",
+        "order": 6,
+        "wid": 5e7,
+        "freq_min": 1.5e9,
+        "freq_max": 4e9,
+        "lam": 1547.461e-9,
+        "window": "hann",
+        "nperseg": 512,
+        "noverlap": 435,
+        "nfft": 5120,
+        "smoothing_window": 601,
+        "smoothing_wid": 3,
+        "smoothing_amp": 1,
+        "smoothing_sigma": 1,
+        "smoothing_mu": 0,
+    }
+
+    # a fast length, lengths with a large prime factor and prime lengths
+    lengths = [200000, 199999, 200003, 2 * 100043, 400009, 3 * 333337]
+
+    print("transform time in ms (largest prime factor, next fast length)")
+    for n in lengths:
+        x = rng.standard_normal(n)
+        m, m_real = next_fast_len(n), next_fast_len(n, True)
+        fft_n = best_of(fft, x)[0]
+        fft_m = best_of(fft, x, n=m)[0]
+        rfft_n = best_of(rfft, x)[0]
+        rfft_m = best_of(rfft, x, n=m_real)[0]
+        print(
+            f"  n={n:<8d} ({largest_prime_factor(n):>7d}, {m:>8d})  fft {fft_n * 1e3:8.2f} -> {fft_m * 1e3:6.2f}  "
+            f"rfft {rfft_n * 1e3:8.2f} -> {rfft_m * 1e3:6.2f}"
+        )
+
+    print("carrier_filter + velocity_calculation in ms")
+    for n in lengths:
+        sdf_out = record(fs, n, rng)
+        for real in (False, True):
+            none = best_of(chain, sdf_out, **inputs, real_fft=real, repeat=3)[0]
+            pad = best_of(chain, sdf_out, **inputs, real_fft=real, fft_padding="pad", repeat=3)[0]
+            print(f"  n={n:<8d} real_fft={str(real):5s}  none {none * 1e3:8.1f}  pad {pad * 1e3:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark the vectorized Otsu top line against the original per-pixel loop.
+
+Run from the repository root with ``python benchmarks/bench_otsu_top_line.py``.
+"""
+
+import time
+import numpy as np
+from alpss.detection.spall_doi_finder import otsu_top_line, otsu_start_index
+
+
+# the original loops from spall_doi_finder
+def loop_top_line(th3, f_doi):
+    col_len = th3.shape[1]
+    row_len = th3.shape[0]
+    top_line = np.zeros(col_len)
+    f_doi_top_line = np.zeros(col_len)
+    for col_idx in range(col_len):
+        for row_idx in range(row_len):
+            idx_top = row_len - row_idx - 1
+            if th3[idx_top, col_idx] == 255:
+                top_line[col_idx] = idx_top
+                f_doi_top_line[col_idx] = f_doi[idx_top]
+                break
+    top_line[top_line == 0] = np.nan
+    f_doi_top_line[np.isnan(top_line)] = np.nan
+    return top_line, f_doi_top_line
+
+
+def loop_start_index(top_line, f_doi_top_line, f_doi_carr_top_idx):
+    highest_idx = np.argmax(f_doi_top_line)
+    for check_idx in range(highest_idx):
+        cidx = highest_idx - check_idx - 1
+        if top_line[cidx] <= f_doi_carr_top_idx:
+            break
+    return cidx
+
+
+def best_of(func, *args, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    # spectrogram ROI sizes for nfft=5120 and a 1.5-4 GHz band (160 rows) at increasing record lengths
+    for cols in [1500, 6000, 24000]:
+        rows = 160
+        th3 = np.zeros((rows, cols), dtype=np.uint8)
+        th3[40:60, :] = 255
+        th3[60:120, cols // 3 :] = 255
+        th3[rng.random((rows, cols)) < 0.01] = 255
+        f_doi = np.linspace(1.5e9, 4e9, rows)
+
+        t_loop, (top_loop, f_loop) = best_of(loop_top_line, th3, f_doi, repeat=1)
+        t_vec, (top_vec, f_vec) = best_of(otsu_top_line, th3, f_doi)
+        np.testing.assert_array_equal(top_vec, top_loop)
+
+        t_loop_idx, cidx_loop = best_of(loop_start_index, top_loop, f_loop, 59, repeat=1)
+        t_vec_idx, cidx_vec = best_of(otsu_start_index, top_vec, f_vec, 59)
+        assert cidx_vec == cidx_loop
+
+        print(
+            f"{rows}x{cols:<6d} top line: loop {t_loop * 1e3:9.2f} ms  vectorized {t_vec * 1e3:7.3f} ms  "
+            f"start index: loop {t_loop_idx * 1e3:7.3f} ms  vectorized {t_vec_idx * 1e3:7.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
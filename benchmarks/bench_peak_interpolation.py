@@ -0,0 +1,79 @@
+"""Accuracy and speed of interpolated spectral peaks against 10x zero padded transforms.
+
+The spectrogram peak of a noisy frequency ramp is tracked frame by frame, once with nfft = 10 * nperseg and an
+argmax, and once with nfft = nperseg refined by each peak_interpolation method. The carrier frequency estimate of
+the unpadded carrier band FFT is compared with and without interpolation.
+
+Run from the repository root with ``python benchmarks/bench_peak_interpolation.py``.
+"""
+
+import time
+import numpy as np
+from alpss.spectral import stft
+from alpss.spectral import peak_offset
+from alpss.carrier.frequency import carrier_frequency
+
+
+def best_of(func, *args, repeat=5, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def ramp(fs, n, rng):
+    # a 2.2 GHz carrier ramping up by 2 GHz over the record, with noise
+    time_s = np.arange(n) / fs
+    freq = 2.2e9 + 2e9 * time_s / time_s[-1]
+    voltage = np.sin(2 * np.pi * np.cumsum(freq) / fs) + 0.05 * rng.standard_normal(n)
+    return freq, voltage
+
+
+def track(voltage, fs, method, **inputs):
+    f, t, Zxx = stft(voltage, fs, **inputs)
+    mag = np.abs(Zxx)
+    k = np.argmax(mag, axis=0)
+    if method is None:
+        return t, f[k]
+    df = f[1] - f[0]
+    return t, f[k] + df * peak_offset(Zxx, k, method)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    fs = 80e9
+    n = 200000
+    freq, voltage = ramp(fs, n, rng)
+    inputs = {"window": "hann", "nperseg": 512, "noverlap": 435}
+
+    print("spectrogram peak track (rms error in MHz, time in ms)")
+    for nfft, method in [(5120, None), (512, None), (512, "parabolic"), (512, "gaussian"), (512, "jacobsen")]:
+        elapsed, (t, peak) = best_of(track, voltage, fs, method, **inputs, nfft=nfft, repeat=3)
+        truth = np.interp(t, np.arange(n) / fs, freq)
+        err = np.sqrt(np.mean((peak - truth)[5:-5] ** 2))
+        stft_time = best_of(stft, voltage, fs, **inputs, nfft=nfft, repeat=3)[0]
+        print(
+            f"  nfft={nfft:<5d} {str(method):10s} rms error {err / 1e6:7.2f}  "
+            f"stft {stft_time * 1e3:8.1f}  stft + peaks {elapsed * 1e3:8.1f}"
+        )
+
+    print("carrier frequency (rms error in MHz over 50 carriers)")
+    time_s = np.arange(n) / fs
+    for method in [None, "parabolic", "gaussian", "jacobsen"]:
+        errs = []
+        for cen in rng.uniform(2.0e9, 2.5e9, 50):
+            voltage = np.sin(2 * np.pi * cen * time_s + rng.uniform(0, 2 * np.pi)) + 0.05 * rng.standard_normal(n)
+            sdf_out = {"fs": fs, "time": time_s, "voltage": voltage}
+            errs.append(
+                carrier_frequency(
+                    sdf_out, freq_min=1.5e9, freq_max=4e9, carrier_band_time=250e-9, peak_interpolation=method
+                )
+                - cen
+            )
+        print(f"  {str(method):10s} rms error {np.sqrt(np.mean(np.square(errs))) / 1e6:7.3f}")
+
+
+if __name__ == "__main__":
+    main()
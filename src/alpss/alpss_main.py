@@ -2,6 +2,7 @@ import os
 from alpss.detection.spall_doi_finder import spall_doi_finder
 from alpss.plotting.plots import plot_results, plot_voltage
 from alpss.plotting.hel import plot_hel_detection
+from alpss.plotting.iq import plot_iq_detection
 from alpss.carrier.frequency import carrier_frequency
 from alpss.carrier.filter import carrier_filter
 from alpss.velocity.calculation import velocity_calculation
@@ -158,6 +159,30 @@ def alpss_main(**inputs):
         **inputs,
     )
 
+    # Generate the IQ start time detection plot as a separate figure (opt-in)
+    if (
+        "iq" in sdf_out
+        and inputs.get("save_iq_start_time_plot", False)
+        and inputs.get("save_all_plots", "yes") == "yes"
+    ):
+        try:
+            iq_fig = plot_iq_detection(sdf_out["iq"])
+            if inputs.get("save_data") == "yes":
+                filename = os.path.splitext(os.path.basename(inputs["filepath"]))[0]
+                if inputs.get("save_plots_in_subfolder", True):
+                    plot_dir = os.path.join(inputs["out_files_dir"], f"{filename}_plots")
+                    os.makedirs(plot_dir, exist_ok=True)
+                else:
+                    plot_dir = inputs["out_files_dir"]
+                iq_path = os.path.join(plot_dir, f"{filename}-IQ_start_time_detection.png")
+                iq_fig.savefig(iq_path, dpi=inputs.get("plot_dpi", 300), format="png", facecolor="w")
+                logger.info("IQ start time plot saved to %s", iq_path)
+            if inputs.get("display_plots") != "yes":
+                import matplotlib.pyplot as _plt
+                _plt.close(iq_fig)
+        except Exception as e:
+            logger.error("Error generating IQ start time plot: %s", str(e))
+
     # Generate HEL diagnostic plot as a separate figure
     hel_fig = None
     if hel_enabled and hel_out.ok:
@@ -2,6 +2,7 @@ import numpy as np
 from scipy.optimize import curve_fit
 import traceback
 import logging
+from alpss.carrier.sine_fit import sine_fit_linear, use_linear_sine_fit
 
 
 # gaussian distribution
@@ -92,6 +93,7 @@ def instantaneous_uncertainty_analysis(sdf_out, vc_out, cen, **inputs):
     voltage_filt = vc_out["voltage_filt"]
     time_start_idx = vc_out["time_start_idx"]
     time_end_idx = vc_out["time_end_idx"]
+    offset = vc_out.get("voltage_filt_offset", 0)
     carrier_band_time = inputs["carrier_band_time"]
 
     # take only real component of the filtered voltage signal
@@ -101,20 +103,28 @@ def instantaneous_uncertainty_analysis(sdf_out, vc_out, cen, **inputs):
     t_take = carrier_band_time
     steps_take = int(t_take * fs)
 
-    # get the data for only the beginning section of the signal
+    # get the data for only the beginning section of the signal. with the 'roi' velocity window voltage_filt only
+    # covers the domain of interest, and the beginning section is returned separately
     time_cut = time[0:steps_take]
-    voltage_filt_early = voltage_filt[0:steps_take]
-
-    try:
-        # fit a sinusoid to the data
-        popt, pcov = curve_fit(
-            sin_func, time_cut, voltage_filt_early, p0=[0.1, cen, 0, 0]
-        )
-    except Exception:
-        # if sin fitting doesn't work set the fitting parameters to be zeros
-        logging.error(traceback.format_exc())
-        popt = [0, 0, 0, 0]
-        pcov = [0, 0, 0, 0]
+    if "voltage_filt_early" in vc_out:
+        voltage_filt_early = np.real(vc_out["voltage_filt_early"])
+    else:
+        voltage_filt_early = voltage_filt[0:steps_take]
+
+    if use_linear_sine_fit(**inputs):
+        # closed form fit at the carrier frequency, optionally refined with Gauss-Newton steps
+        popt, pcov = sine_fit_linear(time_cut, voltage_filt_early, cen, steps=inputs.get("sine_fit_steps", 0))
+    else:
+        try:
+            # fit a sinusoid to the data
+            popt, pcov = curve_fit(
+                sin_func, time_cut, voltage_filt_early, p0=[0.1, cen, 0, 0]
+            )
+        except Exception:
+            # if sin fitting doesn't work set the fitting parameters to be zeros
+            logging.error(traceback.format_exc())
+            popt = [0, 0, 0, 0]
+            pcov = [0, 0, 0, 0]
 
     # calculate the fitted curve
     volt_fit = sin_func(time_cut, popt[0], popt[1], popt[2], popt[3])
@@ -123,7 +133,7 @@ def instantaneous_uncertainty_analysis(sdf_out, vc_out, cen, **inputs):
     noise = voltage_filt_early - volt_fit
 
     # get data for only the doi of the voltage
-    voltage_filt_doi = voltage_filt[time_start_idx:time_end_idx]
+    voltage_filt_doi = voltage_filt[time_start_idx - offset:time_end_idx - offset]
 
     # calculate the envelope indices of the originally imported voltage data (and now filtered) using the stack
     # overflow code
@@ -1,8 +1,21 @@
 import numpy as np
-from scipy.fft import fft, ifft, fftfreq
-from scipy.fftpack import fftshift
-from alpss.utils import stft
+from scipy.fft import fft, ifft, fftfreq, rfft, irfft, set_workers
+from alpss.utils import nearest_index
+from alpss.carrier.sine_fit import sine_fit_linear, use_linear_sine_fit
+from alpss.spectral import (
+    PowerSpectrogram,
+    power_dtype,
+    stft,
+    stft_plan,
+    legacy_crop,
+    fft_workers,
+    fft_frequencies,
+    fft_length,
+    use_real_fft,
+    analytic_from_rfft,
+)
 from scipy.optimize import curve_fit
+from scipy.signal import CZT
 
 # function to filter out the carrier frequency
 def carrier_filter(sdf_out, cen, **inputs):
@@ -17,24 +30,55 @@ def carrier_filter(sdf_out, cen, **inputs):
     f_max = inputs["freq_max"]
     t_doi_start = sdf_out["t_doi_start"]
     t_doi_end = sdf_out["t_doi_end"]
+    workers = fft_workers(**inputs)
 
     # get the index in the time array where the signal begins
-    sig_start_idx = np.argmin(np.abs(time - t_start_corrected))
+    sig_start_idx = nearest_index(time, t_start_corrected)
+    num_after_start = len(time) - sig_start_idx
+
+    # the fused spectral stage does the carrier notch and the band pass of velocity_calculation with a single transform
+    # pair. it supports the gaussian notch and no filtering; sine fit subtraction always uses the two stage chain
+    voltage_analytic = None
+    fused = inputs.get("fused_spectral_stage", False) and inputs["carrier_filter_type"] in ("gaussian_notch", "none")
 
     # choose a filter type (currently gaussian notch and sine fit subtraction)
-    if inputs["carrier_filter_type"] == 'gaussian_notch':
-        # filter the data after the signal start time with a gaussian notch
-        freq = fftshift(
-            np.arange(-len(time[sig_start_idx:]) / 2, len(time[sig_start_idx:]) / 2)
-            * fs
-            / len(time[sig_start_idx:])
-        )
+    if fused:
+        voltage_analytic = fused_carrier_bandpass(voltage, fs, cen, sig_start_idx, **inputs)
+
+        # the signal for the filtered spectrogram. without a carrier filter this is the voltage itself, as in the two
+        # stage chain. the notched signal is not calculated on its own, so the real band-passed signal is used, which
+        # leaves the filtered spectrogram empty outside freq_min to freq_max
+        if inputs["carrier_filter_type"] == "none":
+            voltage_filt = voltage
+        else:
+            voltage_filt = 2 * np.real(voltage_analytic)
+
+        # parameters from the other filter type not needed
+        time_fitting = 'none'
+        time_domain_carrier = 'none'
+        sin_fit = 'none'
+        display_freq = 'none'
+        display_vals = 'none'
+
+    elif inputs["carrier_filter_type"] == 'gaussian_notch':
+        # filter the data after the signal start time with a gaussian notch. the notch is symmetric in frequency, so
+        # with 'real_fft' only the one-sided spectrum is filtered and the result is real. under an 'fft_padding' policy
+        # the segment is zero padded to a fast length and the filtered result cropped back. the segment starts at the
+        # signal start, so the padding also changes the edge transient of the notch there
+        n_fft = fft_length(num_after_start, real=use_real_fft(**inputs), **inputs)
+        freq = fft_frequencies(n_fft, fs, real=use_real_fft(**inputs))
         filt_2 = (
             1
             - np.exp(-((freq - cen) ** order) / wid**order)
             - np.exp(-((freq + cen) ** order) / wid**order)
         )
-        voltage_filt = ifft(fft(voltage[sig_start_idx:]) * filt_2)
+        if use_real_fft(**inputs):
+            voltage_filt = irfft(
+                rfft(voltage[sig_start_idx:], n=n_fft, workers=workers) * filt_2, n=n_fft, workers=workers
+            )
+        else:
+            voltage_filt = ifft(fft(voltage[sig_start_idx:], n=n_fft, workers=workers) * filt_2, workers=workers)
+        voltage_filt = voltage_filt[:num_after_start]
 
         # pair the filtered voltage from after the signal starts with the original data from before the signal starts
         voltage_filt = np.concatenate((voltage[0:sig_start_idx], voltage_filt))
@@ -49,14 +93,15 @@ def carrier_filter(sdf_out, cen, **inputs):
     elif inputs["carrier_filter_type"] == 'sin_fit_subtract':
         t_fit_begin = inputs["t_fit_begin"]
         t_fit_end = inputs["t_fit_end"]
-        all_freq = fftfreq(voltage.size,1/fs)
+        n_fft = fft_length(voltage.size, real=use_real_fft(**inputs), **inputs)
+        all_freq = fftfreq(n_fft,1/fs)
         tmin = t_fit_begin
         tmax = t_fit_end
 
         # perform FFT of carrier band from time tmin to tmax to determine find peaks from both carrier and dopplar signal
         carrier_analysis_time_mask = (time>(t_start_corrected + tmin)) & (time<(t_start_corrected + tmax))
         time_fitting = time[carrier_analysis_time_mask]
-        fft_vals = fft(voltage[carrier_analysis_time_mask])
+        fft_vals = fft(voltage[carrier_analysis_time_mask], workers=workers)
         freq = fftfreq(voltage[carrier_analysis_time_mask].size,1/fs)
 
         # extract out the carrier band peak using the already known frequency from the carrier_frequency function and the wid parameter
@@ -70,28 +115,39 @@ def carrier_filter(sdf_out, cen, **inputs):
         full_fft[mask_sin_fit] = fft_vals_masked
 
         # the corresponding time domain for the isolated carrier band
-        time_domain_carrier = np.real(ifft(full_fft))
+        time_domain_carrier = np.real(ifft(full_fft, workers=workers))
 
         # fit the time domain carrier band with a sine function
         def sin_func(x, a, b, c, d):
             return a * np.sin(2 * np.pi * b * x + c) + d
 
-        try:
-            # fit a sinusoid to the data
-            popt, pcov = curve_fit(
-                sin_func, time_fitting, time_domain_carrier, p0=[(np.max(time_domain_carrier) - np.min(time_domain_carrier)) / 2, cen, 0, 0]
-            )
-        except Exception:
-            # if sin fitting doesn't work set the fitting parameters to be zeros
-            popt = [0, 0, 0, 0]
-            pcov = [0, 0, 0, 0]
+        if use_linear_sine_fit(**inputs):
+            # closed form fit at the carrier frequency, optionally refined with Gauss-Newton steps
+            popt, pcov = sine_fit_linear(time_fitting, time_domain_carrier, cen, steps=inputs.get("sine_fit_steps", 0))
+        else:
+            try:
+                # fit a sinusoid to the data
+                popt, pcov = curve_fit(
+                    sin_func, time_fitting, time_domain_carrier, p0=[(np.max(time_domain_carrier) - np.min(time_domain_carrier)) / 2, cen, 0, 0]
+                )
+            except Exception:
+                # if sin fitting doesn't work set the fitting parameters to be zeros
+                popt = [0, 0, 0, 0]
+                pcov = [0, 0, 0, 0]
 
         # the sinusoidal fit over the fitting time
         sin_fit = sin_func(time_fitting,*popt)
 
-        # filter out any frequencies not in the user specified frequency bounds
-        frequency_mask = (all_freq>f_min) & (all_freq<f_max)
-        voltage_filt = ifft(fft(voltage)*frequency_mask).real
+        # filter out any frequencies not in the user specified frequency bounds. only the positive band is kept, so the
+        # real part is half the band-passed signal
+        if use_real_fft(**inputs):
+            rfreq = fft_frequencies(n_fft, fs, real=True)
+            frequency_mask = (rfreq > f_min) & (rfreq < f_max)
+            voltage_filt = 0.5 * irfft(rfft(voltage, n=n_fft, workers=workers) * frequency_mask, n=n_fft, workers=workers)
+        else:
+            frequency_mask = (all_freq>f_min) & (all_freq<f_max)
+            voltage_filt = ifft(fft(voltage, n=n_fft, workers=workers)*frequency_mask, workers=workers).real
+        voltage_filt = voltage_filt[:voltage.size]
 
         # subtract the carrier band fit
         voltage_filt = voltage_filt - sin_func(time, *popt)
@@ -109,19 +165,33 @@ def carrier_filter(sdf_out, cen, **inputs):
     else:
         raise ValueError(f'Invalid carrier filter type: {inputs["carrier_filter_type"]}')
 
+    # find the stft time frames of the domain of interest
+    t_legacy = legacy_crop(len(voltage_filt), fs, **inputs)[1]
+    t_doi_start_idx = np.argmin(np.abs(t_legacy - t_doi_start))
+    t_doi_end_idx = np.argmin(np.abs(t_legacy - t_doi_end))
+
+    # by default only the frames of the domain of interest, plus the frames within a window half-width on either side,
+    # are calculated. 'filtered_spectrogram': 'full' calculates the filtered spectrogram of the whole record
+    if inputs.get("filtered_spectrogram", "roi") == "full":
+        frames = (0, len(t_legacy))
+    else:
+        SFT = stft_plan(fs, **inputs)
+        half_width = int(np.ceil(SFT.m_num_mid / SFT.hop))
+        frames = (max(0, t_doi_start_idx - half_width), min(len(t_legacy), t_doi_end_idx + half_width))
+
     # perform a stft on the filtered voltage data. Only the real part as to not get a two sided spectrogram
-    f_filt, t_filt, Zxx_filt = stft(np.real(voltage_filt), fs, **inputs)
+    f_filt, t_filt, Zxx_filt = stft(np.real(voltage_filt), fs, frames=frames, **inputs)
 
     # calculate the power
-    power_filt = 10 * np.log10(np.abs(Zxx_filt) ** 2)
+    power_filt = PowerSpectrogram(Zxx_filt, dtype=power_dtype(**inputs)).values
 
     # cut the data to the domain of interest
     f_min_idx = np.argmin(np.abs(f_filt - f_min))
     f_max_idx = np.argmin(np.abs(f_filt - f_max))
-    t_doi_start_idx = np.argmin(np.abs(t_filt - t_doi_start))
-    t_doi_end_idx = np.argmin(np.abs(t_filt - t_doi_end))
-    Zxx_filt_doi = Zxx_filt[f_min_idx:f_max_idx, t_doi_start_idx:t_doi_end_idx]
-    power_filt_doi = power_filt[f_min_idx:f_max_idx, t_doi_start_idx:t_doi_end_idx]
+    doi_start = t_doi_start_idx - frames[0]
+    doi_end = t_doi_end_idx - frames[0]
+    Zxx_filt_doi = Zxx_filt[f_min_idx:f_max_idx, doi_start:doi_end]
+    power_filt_doi = power_filt[f_min_idx:f_max_idx, doi_start:doi_end]
 
     # save outputs to a dictionary
     cf_out = {
@@ -134,4 +204,47 @@ def carrier_filter(sdf_out, cen, **inputs):
         "power_filt_doi": power_filt_doi,
     }
 
+    # the band-passed signal velocity_calculation would otherwise compute
+    if voltage_analytic is not None:
+        cf_out["voltage_analytic"] = voltage_analytic
+
     return cf_out
+
+
+# single transform pair replacement for the gaussian notch (or no filter) of carrier_filter followed by the band pass of
+# velocity_calculation. the rfft of the record is multiplied by the band pass (positive frequencies between freq_min and
+# freq_max only) and the notch together and inverted once, giving the complex band-passed signal velocity_calculation
+# unwraps. the notch only applies after the signal start, so the carrier it removed is added back to the samples before
+# sig_start_idx. the notched band is narrow, so those samples are evaluated with a chirp-z transform of just its bins.
+# under an 'fft_padding' policy the record is zero padded to a fast length and the result cropped back.
+# the two stage chain notches the samples after the signal start as a record of their own, whose first samples wrap
+# around to the end of the record, while here the notch sees the carrier before the signal start. the velocities of
+# the two differ within about the notch's impulse response (around 10 ns for wid = 50 MHz) of the signal start; on the
+# example file the smoothed velocity differs by up to 13 m/s in the first 5 ns and by less than 0.05 m/s after 10 ns
+def fused_carrier_bandpass(voltage, fs, cen, sig_start_idx, **inputs):
+    num = len(voltage)
+    n = fft_length(num, real=True, **inputs)
+    workers = fft_workers(**inputs)
+    freq = fft_frequencies(n, fs, real=True)
+    band = (freq > inputs["freq_min"]) & (freq < inputs["freq_max"])
+    spectrum = rfft(voltage, n=n, workers=workers) * band
+
+    if inputs["carrier_filter_type"] != "gaussian_notch":
+        return analytic_from_rfft(spectrum, n, workers=workers)[:num]
+
+    # the part of the band pass removed by the notch (the negative frequency term of the notch is outside the band)
+    order = inputs["order"]
+    wid = inputs["wid"]
+    carrier = band * np.exp(-((freq - cen) ** order) / wid**order)
+    voltage_analytic = analytic_from_rfft(spectrum * (1 - carrier), n, workers=workers)[:num]
+
+    # add the carrier back before the signal start, from the bins where the notch is not negligible
+    bins = np.flatnonzero(carrier > np.finfo(float).eps)
+    if sig_start_idx > 0 and len(bins) > 0:
+        k0, k1 = bins[0], bins[-1] + 1
+        transform = CZT(k1 - k0, sig_start_idx, w=np.exp(2j * np.pi / n), a=1)
+        phase = np.exp(2j * np.pi * k0 * np.arange(sig_start_idx) / n)
+        with set_workers(workers):
+            voltage_analytic[:sig_start_idx] += phase * transform((spectrum * carrier)[k0:k1]) / n
+
+    return voltage_analytic
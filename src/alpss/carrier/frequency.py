@@ -1,5 +1,7 @@
 import numpy as np
-from scipy.fft import (fft, fftfreq)
+from scipy.fft import fftfreq
+from alpss.spectral import SpectralContext, peak_offset, fft_length
+from alpss.utils import TimeAxis
 
 
 # calculate the carrier frequency as the frequency with the max amplitude within the frequency range of interest
@@ -13,23 +15,35 @@ def carrier_frequency(spall_doi_finder_outputs, **inputs):
     freq_min = inputs['freq_min']
     freq_max = inputs['freq_max']
 
+    # the spectral products of the start time detection, or a fresh set when there are none
+    spectral = spall_doi_finder_outputs.get('spectral')
+    if spectral is None:
+        spectral = SpectralContext(voltage, fs, **inputs)
+
     # cut the time and voltage signals to only take the time during the user input "carrier_band_time".
     # That way there is none of the actual target signal in the FFT.
     # Need this because in some instances the target signal is stronger than the carrier, in which case the target signal may end up being filtered out.
-    # These two lines of code should prevent that from happening and make sure the carrier is filtered properly.
-    time = time[: int(round(inputs["carrier_band_time"] * fs))]
-    voltage = voltage[: int(round(inputs["carrier_band_time"] * fs))]
-
-    # calculate frequency values for fft
-    freq = fftfreq(int(fs * time[-1]) + 1, 1 / fs)
+    # This cut should prevent that from happening and make sure the carrier is filtered properly.
+    n = spectral.carrier_window_length(inputs["carrier_band_time"])
+
+    # find the amplitude values for the fft, reusing the transform of the carrier band from the start time detection
+    # when there is one. under an 'fft_padding' policy the window is zero padded (or trimmed) to a fast transform length
+    length = fft_length(n, trim=True, **inputs)
+    spectrum = spectral.carrier_fft(n, length)
+
+    # calculate frequency values for fft. a measured time column keeps the grid sized from its last carrier band sample.
+    # a synthesized time axis (and any padded or trimmed transform) uses the grid of the transform itself
+    if length == n and not isinstance(time, TimeAxis):
+        freq = fftfreq(int(fs * time[n - 1]) + 1, 1 / fs)
+    else:
+        freq = fftfreq(len(spectrum), 1 / fs)
     freq2 = freq[:int(freq.shape[0] / 2) - 1]
 
     # find the frequency indices that mark the range of interest
     freq_min_idx = np.argmin(np.abs(freq2 - freq_min))
     freq_max_idx = np.argmin(np.abs(freq2 - freq_max))
 
-    # find the amplitude values for the fft
-    ampl = np.abs(fft(voltage))
+    ampl = np.abs(spectrum)
     ampl2 = ampl[:int(freq.shape[0] / 2) - 1]
 
     # cut the frequency and amplitude to the range of interest
@@ -39,5 +53,10 @@ def carrier_frequency(spall_doi_finder_outputs, **inputs):
     # find the carrier as the frequency with the max amplitude
     cen = freq3[np.argmax(ampl3)]
 
+    # optionally refine the carrier between the fft bins from the peak and its neighbours
+    if inputs.get("peak_interpolation"):
+        peak_idx = freq_min_idx + np.argmax(ampl3)
+        cen = cen + peak_offset(spectrum, peak_idx, inputs["peak_interpolation"]) * (freq[1] - freq[0])
+
     # return the carrier frequency
     return cen
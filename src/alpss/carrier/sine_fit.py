@@ -0,0 +1,52 @@
+import numpy as np
+
+
+# fit a * sin(2 * pi * b * x + c) + d to (x, y) at the known frequency freq by linear least squares: the sine and
+# cosine amplitudes and the offset are solved in closed form (normal equations). steps Gauss-Newton iterations then refine all four
+# parameters including the frequency. deterministic, with a fixed amount of work, and never fails (an empty or
+# degenerate fit gives zeros). returns popt = [a, b, c, d] (with a >= 0) and its covariance estimate, like curve_fit
+def sine_fit_linear(x, y, freq, steps=0):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) < 4:
+        return np.zeros(4), np.zeros((4, 4))
+
+    omega = 2 * np.pi * freq
+    x_scale = np.max(np.abs(x)) or 1.0
+    for step in range(steps + 1):
+        sin, cos = np.sin(omega * x), np.cos(omega * x)
+        basis = np.column_stack((sin, cos, np.ones_like(x)))
+        (A, B, d), *_ = np.linalg.lstsq(basis.T @ basis, basis.T @ y, rcond=None)
+        if step == steps:
+            break
+
+        # Gauss-Newton step on (A, B, d, omega), with the frequency column scaled to the size of the others
+        residual = y - basis @ (A, B, d)
+        jacobian = np.column_stack((basis, (x / x_scale) * (A * cos - B * sin)))
+        delta, *_ = np.linalg.lstsq(jacobian.T @ jacobian, jacobian.T @ residual, rcond=None)
+        omega += delta[3] / x_scale
+
+    # A sin(wx) + B cos(wx) = a sin(wx + c)
+    a = np.hypot(A, B)
+    c = np.arctan2(B, A)
+    popt = np.array([a, omega / (2 * np.pi), c, d])
+
+    # covariance of [a, b, c, d] from the jacobian at the solution and the residual variance. the sine and cosine of
+    # the fitted phase follow from the last basis without evaluating them again
+    sin_theta = (A * sin + B * cos) / (a or 1.0)
+    cos_theta = (A * cos - B * sin) / (a or 1.0)
+    jacobian = np.column_stack((sin_theta, a * cos_theta * 2 * np.pi * x, a * cos_theta, np.ones_like(x)))
+    residual = y - (a * sin_theta + d)
+    norms = np.linalg.norm(jacobian, axis=0)
+    norms[norms == 0] = 1.0
+    scaled = jacobian / norms
+    pcov = np.linalg.pinv(scaled.T @ scaled) / np.outer(norms, norms)
+    pcov *= np.sum(residual**2) / max(len(x) - 4, 1)
+
+    return popt, pcov
+
+
+# fit the carrier sinusoid with the method set by the 'sine_fit' input: 'curve_fit' (the default, handled by the
+# caller) or 'linear' (sine_fit_linear with 'sine_fit_steps' Gauss-Newton steps, default 0)
+def use_linear_sine_fit(**inputs):
+    return inputs.get("sine_fit", "curve_fit") == "linear"
@@ -2,6 +2,7 @@ import argparse
 
 from alpss.alpss_watcher import Watcher
 from alpss.alpss_main import alpss_main
+from alpss.io.cache import cache_dir, cache_info, purge
 import os
 import json
 import logging
@@ -59,4 +60,29 @@ def alpss_cli():
         sys.exit(alpss_main_with_config())
     except Exception as e:
         print(f"[ALPSS ERROR] {e}", file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+
+
+def cache_cli():
+    """
+    Entry point for the `alpss-cache` console script to inspect and purge the parsed trace cache.
+    """
+    parser = argparse.ArgumentParser(description="Inspect or purge the ALPSS parsed trace cache")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Cache directory (default: ALPSS_CACHE_DIR or ~/.cache/alpss)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("info", help="List cache entries and their total size")
+    purge_parser = subparsers.add_parser("purge", help="Delete cache entries")
+    purge_parser.add_argument("--older-than", type=float, default=None, help="Delete entries unused for this many days")
+    purge_parser.add_argument("--max-size", type=float, default=None, help="Evict least recently used entries until the cache is below this many MB (after --older-than)")
+    args = parser.parse_args()
+
+    path = cache_dir(cache_dir=args.cache_dir)
+    if args.command == "info":
+        print(cache_info(path))
+    else:
+        removed = purge(
+            path,
+            older_than=None if args.older_than is None else args.older_than * 86400,
+            max_bytes=None if args.max_size is None else int(args.max_size * 1024**2),
+        )
+        print(f"removed {len(removed)} entries from {path}")
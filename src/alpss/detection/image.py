@@ -0,0 +1,145 @@
+import numpy as np
+from functools import lru_cache
+
+
+# fixed kernels OpenCV uses for small apertures when sigma is not positive
+SMALL_GAUSSIAN_KERNELS = {
+    1: [1.0],
+    3: [0.25, 0.5, 0.25],
+    5: [0.0625, 0.25, 0.375, 0.25, 0.0625],
+    7: [0.03125, 0.109375, 0.21875, 0.28125, 0.21875, 0.109375, 0.03125],
+}
+
+
+def cv2_available():
+    """
+    Whether OpenCV can be imported. OpenCV is an optional dependency (the "opencv" extra).
+    """
+    try:
+        import cv2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def image_backend(**inputs):
+    """
+    Resolve the image processing backend from the image_backend input: "opencv", "numpy" or "auto" (the default,
+    OpenCV when it is installed and numpy otherwise).
+    """
+    backend = inputs.get("image_backend", "auto")
+    if backend == "auto":
+        return "opencv" if cv2_available() else "numpy"
+    if backend not in ("opencv", "numpy"):
+        raise ValueError(f"image_backend must be 'auto', 'opencv' or 'numpy', not {backend!r}")
+    return backend
+
+
+@lru_cache(maxsize=32)
+def gaussian_kernel_fixed_point(n, sigma):
+    """
+    Gaussian kernel of odd length n as integers summing to 256, as used by OpenCV's bit-exact 8-bit GaussianBlur.
+    If sigma is not positive it is derived from n (or one of the fixed small kernels is used).
+    """
+    if sigma <= 0 and n in SMALL_GAUSSIAN_KERNELS:
+        kernel = np.array(SMALL_GAUSSIAN_KERNELS[n])
+    else:
+        if sigma <= 0:
+            sigma = n * 0.15 + 0.35
+        x = np.arange(n) - (n - 1) / 2
+        kernel = np.exp(-(x**2) / (2 * sigma**2))
+        kernel = kernel / kernel.sum()
+
+    # round to 8 fractional bits with error diffusion from the edges inwards, the center takes up the remainder
+    fixed = np.zeros(n, dtype=np.int64)
+    err = 0.0
+    for i in range(n // 2):
+        v = kernel[i] * 256 + err
+        fixed[i] = fixed[n - 1 - i] = np.rint(v)
+        err = v - fixed[i]
+    fixed[n // 2] = 256 - 2 * fixed[: n // 2].sum()
+    return fixed
+
+
+def gaussian_blur(image, ksize, sigma_x, sigma_y=0):
+    """
+    Gaussian blur of a uint8 image matching cv2.GaussianBlur (default reflect-101 border). ksize is (width, height);
+    a non-positive size is derived from the sigma and a non-positive sigma_y takes sigma_x.
+    """
+    width, height = ksize
+    if sigma_y <= 0:
+        sigma_y = sigma_x
+    if width <= 0 and sigma_x > 0:
+        width = int(np.rint(sigma_x * 3 * 2 + 1)) | 1
+    if height <= 0 and sigma_y > 0:
+        height = int(np.rint(sigma_y * 3 * 2 + 1)) | 1
+    if width % 2 == 0 or height % 2 == 0:
+        raise ValueError("blur_kernel sizes must be odd")
+
+    kx = gaussian_kernel_fixed_point(width, max(sigma_x, 0))
+    ky = gaussian_kernel_fixed_point(height, max(sigma_y, 0))
+
+    # separable integer filtering: rows then columns, each kernel carries 8 fractional bits
+    padded = np.pad(image.astype(np.int64), ((height // 2, height // 2), (width // 2, width // 2)), mode="reflect")
+    rows = np.zeros((padded.shape[0], image.shape[1]), dtype=np.int64)
+    for i, k in enumerate(kx):
+        rows += k * padded[:, i : i + image.shape[1]]
+    out = np.zeros(image.shape, dtype=np.int64)
+    for j, k in enumerate(ky):
+        out += k * rows[j : j + image.shape[0]]
+
+    # round half up back to uint8
+    return ((out + (1 << 15)) >> 16).astype(np.uint8)
+
+
+def otsu_threshold(image):
+    """
+    Otsu's binarization of a uint8 image matching cv2.threshold with THRESH_BINARY + THRESH_OTSU.
+    Returns:
+    - Threshold value
+    - Binary image (255 above the threshold, 0 otherwise)
+    """
+    hist = np.bincount(image.ravel(), minlength=256)
+    scale = 1.0 / image.size
+    mu = float(np.dot(np.arange(256), hist)) * scale
+
+    # the between class variance is accumulated in the same order as OpenCV so ties resolve identically
+    eps = np.finfo(np.float32).eps
+    mu1 = q1 = 0.0
+    max_sigma = max_val = 0.0
+    for i, h in enumerate(hist.tolist()):
+        p_i = h * scale
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < eps or max(q1, q2) > 1.0 - eps:
+            continue
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+        if sigma > max_sigma:
+            max_sigma = sigma
+            max_val = float(i)
+
+    return max_val, np.where(image > max_val, 255, 0).astype(np.uint8)
+
+
+def blur_and_threshold(image, full_output=False, **inputs):
+    """
+    Gaussian blur (blur_kernel, blur_sigx, blur_sigy) followed by Otsu's binarization of a uint8 image with the
+    backend selected by image_backend.
+    Returns:
+    - Thresholded uint8 image (0 or 255)
+    - With full_output, also the blurred image and the Otsu threshold as (th3, blur, threshold)
+    """
+    if image_backend(**inputs) == "opencv":
+        import cv2 as cv
+
+        blur = cv.GaussianBlur(image, tuple(inputs["blur_kernel"]), inputs["blur_sigx"], sigmaY=inputs["blur_sigy"])
+        ret3, th3 = cv.threshold(blur, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+    else:
+        blur = gaussian_blur(image, inputs["blur_kernel"], inputs["blur_sigx"], inputs["blur_sigy"])
+        ret3, th3 = otsu_threshold(blur)
+    if full_output:
+        return th3, blur, ret3
+    return th3
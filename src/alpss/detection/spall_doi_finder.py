@@ -1,31 +1,107 @@
 import numpy as np
-import cv2 as cv
-from alpss.utils import stft
+from alpss.utils import TimeAxis
+from alpss.spectral import SpectralContext, PowerSpectrogram, power_dtype, stft, stft_bin, legacy_crop, fft_workers
+from alpss.detection.image import blur_and_threshold
 import logging
 from scipy import signal
-from scipy.fft import fft, fftfreq
-import matplotlib.pyplot as plt
-import os
+from scipy.fft import fftfreq, set_workers, rfft, fft, ifft, next_fast_len
+from dataclasses import dataclass
 
-# function to find the specific domain of interest in the larger signal
-def spall_doi_finder(data, **inputs):
+logger = logging.getLogger("alpss")
 
-    # rename the columns of the data
-    data.columns = ["Time", "Ampl"]
 
-    # put the data into numpy arrays. Zero the time data
-    time = data["Time"].to_numpy()
-    time = time - time[0]
-    voltage = data["Ampl"].to_numpy()
+class LazyOutputs(dict):
+    """Output dictionary with entries that are calculated the first time they are read.
 
-    # calculate the true sample rate from the experimental data
-    fs = 1 / np.mean(np.diff(time))
+    ``defer(key, func)`` registers ``func`` to calculate ``self[key]`` on the first ``self[key]`` or
+    ``self.get(key)``, after which the value is stored like any other entry. ``key in self`` is true for deferred
+    entries but does not calculate them. Costly outputs only some callers need (e.g. the spectrogram shown in the
+    plots) then cost nothing for the others.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._deferred = {}
+
+    def defer(self, key, func):
+        self._deferred[key] = func
+
+    def __missing__(self, key):
+        if key not in self._deferred:
+            raise KeyError(key)
+        value = self[key] = self._deferred.pop(key)()
+        return value
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self._deferred
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+@dataclass
+class IQResult:
+    """Result of IQ demodulation start time detection."""
+
+    t_start_detected: float
+    carrier_frequency: float
+    initial_amplitude: float
+    threshold: float
+    # Envelopes and their sample times for plotting
+    time: np.ndarray
+    amplitude: np.ndarray
+    phase: np.ndarray
 
-    # calculate the short time fourier transform
-    f, t, Zxx = stft(voltage, fs, **inputs)
 
-    # calculate magnitude of Zxx
-    mag = np.abs(Zxx)
+# function to find the specific domain of interest in the larger signal. spectral is an optional SpectralContext of
+# the same record from an earlier call, whose transforms are reused
+def spall_doi_finder(data, spectral=None, **inputs):
+
+    # for uniformly sampled data the time column is not read at all. time is represented by its start, step and
+    # length and only materialized where a full array is needed (e.g. plotting)
+    if inputs.get("time_axis", "column") == "synthesized":
+        voltage = data.iloc[:, -1].to_numpy()
+        fs = inputs["sample_rate"]
+        time = TimeAxis(0.0, 1 / fs, len(voltage))
+
+    else:
+        # rename the columns of the data
+        data.columns = ["Time", "Ampl"]
+
+        # put the data into numpy arrays. Zero the time data
+        time = data["Time"].to_numpy()
+        time = time - time[0]
+        voltage = data["Ampl"].to_numpy()
+
+        # calculate the true sample rate from the experimental data
+        fs = 1 / np.mean(np.diff(time))
+
+    # spectral products of the record shared by the detectors and the carrier frequency estimate
+    if spectral is None:
+        spectral = SpectralContext(voltage, fs, **inputs)
+
+    # outputs that need the spectrogram are deferred and only calculated when they are read, by the otsu and stft
+    # cusum detection below or later by the plots. the sliding dft cusum tracker, iq and a user start time never
+    # calculate the spectrogram themselves
+    sdf_out = LazyOutputs()
+
+    # coarse-to-fine otsu detection: the start time is first located on a cheap low resolution spectrogram and the
+    # full resolution spectrogram is only calculated in a window around it
+    if inputs.get("start_time_user") == "otsu" and inputs.get("otsu_coarse_to_fine", False):
+        frames = otsu_fine_frames(voltage, fs, **inputs)
+        f, t, Zxx = stft(voltage, fs, frames=frames, **inputs)
+        mag = np.abs(Zxx)
+        sdf_out.update(Zxx=Zxx, mag=mag, power=PowerSpectrogram(magnitude=mag, dtype=power_dtype(**inputs)))
+        t_ref = t[0] - legacy_crop(len(voltage), fs, **inputs)[1][0]
+
+    else:
+        # the frequency and time arrays of the short time fourier transform, its complex values, magnitude and dB
+        # power (shared with the plots)
+        f, t = spectral.grid
+        sdf_out.defer("Zxx", lambda: spectral.spectrogram[2])
+        sdf_out.defer("mag", lambda: spectral.magnitude)
+        sdf_out.defer("power", lambda: spectral.power)
+        t_ref = 0.0
 
     # calculate the time and frequency resolution of the transform
     t_res = np.mean(np.diff(t))
@@ -35,28 +111,12 @@ def spall_doi_finder(data, **inputs):
     freq_min_idx = np.argmin(np.abs(f - inputs["freq_min"]))
     freq_max_idx = np.argmin(np.abs(f - inputs["freq_max"]))
 
-    # cut the magnitude and frequency arrays to smaller ranges
-    mag_cut = mag[freq_min_idx:freq_max_idx, :]
+    # cut the power and frequency arrays to smaller ranges
     f_doi = f[freq_min_idx:freq_max_idx]
+    sdf_out.defer("power_cut", lambda: sdf_out["power"][freq_min_idx:freq_max_idx, :])
 
-    # calculate spectrogram power
-    power_cut = 10 * np.log10(mag_cut**2)
-
-    # convert spectrogram powers to uint8 for image processing
-    smin = np.min(power_cut)
-    smax = np.max(power_cut)
-    a = 255 / (smax - smin)
-    b = 255 - a * smax
-    power_gray = a * power_cut + b
-    power_gray8 = power_gray.astype(np.uint8)
-
-    # blur using a gaussian filter
-    blur = cv.GaussianBlur(
-        power_gray8, inputs["blur_kernel"], inputs["blur_sigx"], inputs["blur_sigy"]
-    )
-
-    # automated thresholding using Otsu's binarization
-    ret3, th3 = cv.threshold(blur, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+    # threshold the spectrogram image with Otsu's binarization
+    sdf_out.defer("th3", lambda: otsu_threshold_image(sdf_out["power_cut"], **inputs))
 
     # if not using a user input value for the signal start time
     # if inputs["start_time_user"] == "none":
@@ -70,57 +130,27 @@ def spall_doi_finder(data, **inputs):
     # start_time_user is either a float for manual search, or a string determining the algorithm to find t_start_detected
     if not is_a_float(inputs.get("start_time_user")): 
         if inputs.get('start_time_user') == "otsu":
-            # Find the position/row of the top of the binary spectrogram for each time/column
-            col_len = th3.shape[1]  # number of columns
-            row_len = th3.shape[0]  # number of columns
-            top_line = np.zeros(col_len)  # allocate space to place the indices
-            f_doi_top_line = np.zeros(
-                col_len
-            )  # allocate space to place the corresponding frequencies
-
-            for col_idx in range(col_len):  # loop over every column
-                for row_idx in range(row_len):  # loop over every row
-                    # moving from the top down, if the pixel is 255 then store the index and break to move to the next column
-                    idx_top = row_len - row_idx - 1
-
-                    if th3[idx_top, col_idx] == 255:
-                        top_line[col_idx] = idx_top
-                        f_doi_top_line[col_idx] = f_doi[idx_top]
-                        break
-
-            # if the signal completely drops out there will be elements of f_doi_top_line equal to zero - these points are
-            # made NaNs. Same for top_line.
-            f_doi_top_line_clean = f_doi_top_line.copy()
-            f_doi_top_line_clean[np.where(top_line == 0)] = np.nan
-            top_line_clean = top_line.copy()
-            top_line_clean[np.where(top_line == 0)] = np.nan
-
-            # find the index of t where the time is closest to the user input carrier_band_time
-            carr_idx = np.argmin(np.abs(t - inputs["carrier_band_time"]))
-
-            # calculate the average frequency of the top of the carrier band during carrier_band_time
-            f_doi_carr_top_avg = np.mean(f_doi_top_line_clean[:carr_idx])
-
-            # find the index in f_doi that is closest in frequency to f_doi_carr_top_avg
-            f_doi_carr_top_idx = np.argmin(np.abs(f_doi - f_doi_carr_top_avg))
-
-            # work backwards from the highest point on the signal top line until it matches or dips below f_doi_carr_top_idx
-            highest_idx = np.argmax(f_doi_top_line_clean)
-            for check_idx in range(highest_idx):
-                cidx = highest_idx - check_idx - 1
-                if top_line_clean[cidx] <= f_doi_carr_top_idx:
-                    break
-            
-            # add in the user correction for the start time
-            t_start_detected = t[cidx]
+            # threshold the spectrogram image. with peak_interpolation the blurred image is kept to interpolate the top
+            # line between rows
+            if inputs.get("peak_interpolation"):
+                th3, blur, threshold = otsu_threshold_image(sdf_out["power_cut"], full_output=True, **inputs)
+                sdf_out["th3"] = th3
+            else:
+                th3, blur, threshold = sdf_out["th3"], None, None
+
+            # find the start time from the top line of the thresholded spectrogram. the carrier band is measured from the
+            # start of the (possibly windowed) spectrogram
+            t_start_detected, carr_idx, f_doi_carr_top_idx, f_doi_top_line_clean = otsu_start_time(
+                t, f_doi, th3, inputs["carrier_band_time"], t_ref=t_ref, blur=blur, threshold=threshold
+            )
         elif inputs.get('start_time_user') == "iq":
-            t_start_detected_iq, amplitude, phase = iq_analysis(inputs, voltage, fs, time)
+            iq_out = iq_detection(voltage, fs, time, spectral=spectral, **inputs)
 
             carr_idx = np.nan
             f_doi_carr_top_idx = np.nan
             f_doi_top_line_clean = np.nan
             
-            t_start_detected = t_start_detected_iq
+            t_start_detected = iq_out.t_start_detected
         elif inputs["start_time_user"]=="cusum": 
 
             # Collect necessary parameters
@@ -129,14 +159,17 @@ def spall_doi_finder(data, **inputs):
             h=inputs["cusum_threshold"]
 
             # Carrier band Frequency
-            carrier_mask = time < carrier_band_time
-            carrier_fft_vals = fft(voltage[carrier_mask])
-            carrier_fft_freqs = fftfreq(voltage[carrier_mask].size,1/fs)
+            carrier_fft_vals = spectral.carrier_fft(spectral.carrier_window_length(carrier_band_time))
+            carrier_fft_freqs = fftfreq(carrier_fft_vals.size,1/fs)
             mask3 = carrier_fft_freqs > 0
             max_idx = np.argmax(np.abs(carrier_fft_vals*mask3))
             cen = carrier_fft_freqs[max_idx]
             idx = np.argmin(np.abs(f-cen))
-            signal = mag[idx,:]
+            if inputs.get("cusum_tracker", "stft") == "sliding_dft":
+                # track only the carrier bin, straight from the samples
+                signal = np.abs(stft_bin(voltage, fs, cen, **inputs)[2])
+            else:
+                signal = sdf_out["mag"][idx,:]
             mask4 = t < carrier_band_time
             mask5 = t > (t.max()-carrier_band_time)
             mu0 = np.mean(signal[mask4])
@@ -177,39 +210,203 @@ def spall_doi_finder(data, **inputs):
 
     t_doi_start_spec_idx = np.argmin(np.abs(t - t_doi_start))
     t_doi_end_spec_idx = np.argmin(np.abs(t - t_doi_end))
-    mag_doi = mag_cut[:, t_doi_start_spec_idx:t_doi_end_spec_idx]
-    power_doi = 10 * np.log10(mag_doi**2)
+    sdf_out.defer("power_doi", lambda: sdf_out["power_cut"][:, t_doi_start_spec_idx:t_doi_end_spec_idx])
 
     # dictionary to return outputs
-    sdf_out = {
-        "time": time,
-        "voltage": voltage,
-        "fs": fs,
-        "f": f,
-        "t": t,
-        "Zxx": Zxx,
-        "t_res": t_res,
-        "f_res": f_res,
-        "f_doi": f_doi,
-        "mag": mag,
-        "th3": th3,
-        "carr_idx": carr_idx,
-        "f_doi_carr_top_idx": f_doi_carr_top_idx,
-        "t_start_detected": t_start_detected,
-        "t_start_corrected": t_start_corrected,
-        "t_doi_start": t_doi_start,
-        "t_doi_end": t_doi_end,
-        "power_doi": power_doi,
-        "start_time_user": inputs.get('start_time_user')
-    }
+    sdf_out.update(
+        {
+            "time": time,
+            "voltage": voltage,
+            "fs": fs,
+            "f": f,
+            "t": t,
+            "t_res": t_res,
+            "f_res": f_res,
+            "f_doi": f_doi,
+            "carr_idx": carr_idx,
+            "f_doi_carr_top_idx": f_doi_carr_top_idx,
+            "t_start_detected": t_start_detected,
+            "t_start_corrected": t_start_corrected,
+            "t_doi_start": t_doi_start,
+            "t_doi_end": t_doi_end,
+            "start_time_user": inputs.get('start_time_user'),
+            "spectral": spectral,
+        }
+    )
 
     if inputs.get('start_time_user') == "iq":
-        sdf_out['amplitude'] = amplitude
-        sdf_out['phase'] = phase
+        sdf_out['iq'] = iq_out
+        sdf_out['amplitude'] = iq_out.amplitude
+        sdf_out['phase'] = iq_out.phase
 
     return sdf_out
 
 
+def compare_start_detectors(data, detectors=("otsu", "iq", "cusum"), **inputs):
+    """
+    Run several start time detectors on the same shot for comparison. The stft, the carrier band fft and the
+    full record fft are calculated once and shared between the detectors.
+    Returns:
+    - Dictionary of the detected signal start time for each detector (NaN if the detector failed)
+    """
+    spectral = None
+    start_times = {}
+    for detector in detectors:
+        try:
+            sdf_out = spall_doi_finder(data, spectral=spectral, **{**inputs, "start_time_user": detector})
+        except (ValueError, IndexError) as e:
+            logger.warning("Start time detector %s failed: %s", detector, str(e))
+            start_times[detector] = np.nan
+            continue
+        spectral = sdf_out["spectral"]
+        start_times[detector] = sdf_out["t_start_detected"]
+    return start_times
+
+
+def otsu_threshold_image(power_cut, full_output=False, **inputs):
+    """
+    Binarize the spectrogram power in dB (cut to the frequency range of interest) for the Otsu start time detection.
+    Returns:
+    - Thresholded uint8 image (0 or 255)
+    - With full_output, also the blurred image and the Otsu threshold as (th3, blur, threshold)
+    """
+    # convert spectrogram powers to uint8 for image processing
+    smin = np.min(power_cut)
+    smax = np.max(power_cut)
+    a = 255 / (smax - smin)
+    b = 255 - a * smax
+    power_gray = a * power_cut + b
+    power_gray8 = power_gray.astype(np.uint8)
+
+    # blur using a gaussian filter and apply automated thresholding using Otsu's binarization
+    return blur_and_threshold(power_gray8, full_output=full_output, **inputs)
+
+
+def otsu_start_time(t, f_doi, th3, carrier_band_time, t_ref=0.0, blur=None, threshold=None):
+    """
+    Find the signal start time from the top line of the thresholded spectrogram. The carrier band is the first
+    carrier_band_time of the spectrogram after t_ref, the time of its first frame relative to the full record.
+    If the blurred image and Otsu threshold are given, the top line frequencies are interpolated between rows
+    (otsu_top_line_interpolated) and the carrier band top is the row containing their average.
+    Returns:
+    - Detected signal start time
+    - Index of t at the end of the carrier band
+    - Index of f_doi of the average top of the carrier band
+    - Frequency of the top line of each time frame (NaN where there is no signal)
+    """
+    # Find the position/row of the top of the binary spectrogram for each time/column. if the signal completely
+    # drops out the top line is NaN
+    top_line_clean, f_doi_top_line_clean = otsu_top_line(th3, f_doi)
+    if blur is not None:
+        f_doi_top_line_clean = otsu_top_line_interpolated(blur, threshold, top_line_clean, f_doi)
+
+    # find the index of t where the time is closest to the user input carrier_band_time
+    carr_idx = np.argmin(np.abs(t - t_ref - carrier_band_time))
+
+    # calculate the average frequency of the top of the carrier band during carrier_band_time
+    f_doi_carr_top_avg = np.mean(f_doi_top_line_clean[:carr_idx])
+
+    # find the index in f_doi that is closest in frequency to f_doi_carr_top_avg. the interpolated top line sits
+    # between the rows, so the comparison with the (whole row) top line uses the row containing the average
+    if blur is not None:
+        f_doi_carr_top_idx = max(np.searchsorted(f_doi, f_doi_carr_top_avg, side="right") - 1, 0)
+    else:
+        f_doi_carr_top_idx = np.argmin(np.abs(f_doi - f_doi_carr_top_avg))
+
+    # work backwards from the highest point on the signal top line until it matches or dips below f_doi_carr_top_idx
+    cidx = otsu_start_index(top_line_clean, f_doi_top_line_clean, f_doi_carr_top_idx)
+
+    return t[cidx], carr_idx, f_doi_carr_top_idx, f_doi_top_line_clean
+
+
+def otsu_fine_frames(voltage, fs, **inputs):
+    """
+    First pass of the coarse-to-fine Otsu detection. The start time is found on a low resolution spectrogram
+    (coarse_nfft, default nperseg, and coarse_noverlap, default nperseg // 2). The fine spectrogram window covers
+    carrier_band_time plus coarse_guard_time before it and coarse_guard_time plus t_after after it.
+    Returns:
+    - (start, stop) range of the legacy stft frames of the fine window
+    """
+    coarse_inputs = {
+        **inputs,
+        "nfft": inputs.get("coarse_nfft", inputs["nperseg"]),
+        "noverlap": inputs.get("coarse_noverlap", inputs["nperseg"] // 2),
+    }
+    f, t, Zxx = stft(voltage, fs, **coarse_inputs)
+    freq_min_idx = np.argmin(np.abs(f - inputs["freq_min"]))
+    freq_max_idx = np.argmin(np.abs(f - inputs["freq_max"]))
+    power_cut = PowerSpectrogram(Zxx[freq_min_idx:freq_max_idx, :], dtype=power_dtype(**inputs)).values
+    th3 = otsu_threshold_image(power_cut, **inputs)
+    t_coarse = otsu_start_time(t, f[freq_min_idx:freq_max_idx], th3, inputs["carrier_band_time"])[0]
+
+    guard = inputs.get("coarse_guard_time", 100e-9)
+    t_legacy = legacy_crop(len(voltage), fs, **inputs)[1]
+    start = np.searchsorted(t_legacy, t_coarse - inputs["carrier_band_time"] - guard)
+    stop = np.searchsorted(t_legacy, t_coarse + guard + float(inputs["t_after"]), side="right")
+    return int(start), int(stop)
+
+
+def otsu_top_line(th3, f_doi):
+    """
+    Find the topmost 255 pixel of every column of the Otsu thresholded spectrogram.
+    Returns:
+    - Row index of the top of the binary spectrogram for each column
+    - The corresponding frequencies from f_doi
+    Columns with no 255 pixel (the signal completely drops out) are NaN in both. A top pixel in row 0 is
+    indistinguishable from no pixel and is also NaN
+    """
+    row_len = th3.shape[0]
+    white = th3 == 255
+
+    # the first 255 pixel moving from the top down is the first one in the row-reversed image
+    top_line = (row_len - 1 - np.argmax(white[::-1], axis=0)).astype(float)
+    top_line[~white.any(axis=0) | (top_line == 0)] = np.nan
+
+    f_doi_top_line = np.full(top_line.shape, np.nan)
+    found = ~np.isnan(top_line)
+    f_doi_top_line[found] = f_doi[top_line[found].astype(int)]
+
+    return top_line, f_doi_top_line
+
+
+def otsu_top_line_interpolated(blur, threshold, top_line, f_doi):
+    """
+    Sub-row frequency of the top line: the Otsu threshold crossing of the blurred image, linearly interpolated between
+    the top 255 row of each column and the row above it. Columns where top_line is NaN stay NaN.
+    Returns:
+    - Interpolated frequency of the top line for each column
+    """
+    f_doi_top_line = np.full(top_line.shape, np.nan)
+    found = np.flatnonzero(~np.isnan(top_line))
+    rows = top_line[found].astype(int)
+    f_doi_top_line[found] = f_doi[rows]
+
+    # the top row is above the threshold and the row above it (if any) is not
+    inside = rows < len(f_doi) - 1
+    cols, rows = found[inside], rows[inside]
+    below = blur[rows, cols].astype(float)
+    above = blur[rows + 1, cols].astype(float)
+    frac = (below - threshold) / (below - above)
+    f_doi_top_line[cols] += frac * (f_doi[rows + 1] - f_doi[rows])
+
+    return f_doi_top_line
+
+
+def otsu_start_index(top_line, f_doi_top_line, f_doi_carr_top_idx):
+    """
+    Work backwards from the highest point on the signal top line to the last column before it whose top line
+    matches or dips below f_doi_carr_top_idx. Returns the column index of the signal start, or 0 if no earlier
+    column is at or below the carrier band
+    """
+    # as with np.argmax, a NaN in the top line counts as its highest point
+    highest_idx = np.argmax(f_doi_top_line)
+    if highest_idx == 0:
+        raise ValueError("The highest point of the Otsu top line is in the first time frame, no start time found")
+
+    below = np.flatnonzero(top_line[:highest_idx] <= f_doi_carr_top_idx)
+    return below[-1] if len(below) else 0
+
+
 def cusum(signal, mu0, mu1, sigma, h, k):
     """
     Detect a single mean shift from mu0 to mu1 using CUSUM.
@@ -218,29 +415,109 @@ def cusum(signal, mu0, mu1, sigma, h, k):
     - Estimated change point index
     - Full G[k] array
     """
+    detect_idx, change_idx, G, s = cusum_batch(signal, mu0, mu1, sigma, h, k)
+
+    # If no change detected
+    if detect_idx[0] < 0:
+        return None, None, G[0], s[0]
+
+    return int(detect_idx[0]), change_idx[0], G[0], s[0]
+
+
+# column vector of per-row values, or a scalar left as is, for broadcasting against a batch of signals
+def _per_row(x):
+    return np.reshape(x, (-1, 1)) if np.ndim(x) else x
+
+
+def _cusum_statistics(signals, mu0, sigma, k):
     # Score for general mean change
-    Z = (signal - mu0)/(np.sqrt(sigma))
-    s = -Z - k
-    # s = ((mu1 - mu0) / sigma) * (signal - mu0) - ((mu0**2 - mu1**2) / (2 * sigma))
-    G = np.zeros_like(s)
+    Z = (signals - _per_row(mu0)) / np.sqrt(_per_row(sigma))
+    s = -Z - _per_row(k)
 
-    for k in range(1, len(s)):
-        G[k] = max(G[k-1] + s[k], 0)
+    # the recursion G[k] = max(G[k-1] + s[k], 0) with G[0] = 0 is the running sum of s[1:] minus its running minimum
+    # (including the zero it starts from)
+    C = np.zeros_like(s)
+    np.cumsum(s[:, 1:], axis=1, out=C[:, 1:])
+    G = C - np.minimum.accumulate(C, axis=1)
 
-        if G[k] > h:
-            detect_idx = k
-            S = np.cumsum(s[:detect_idx])
-            change_idx = np.argmin(S)
-            return detect_idx, change_idx, G, s
+    # change point for a detection at index d is argmin(cumsum(s[:d])). record the index of the first occurrence of
+    # the running minimum of the cumulative sum, so that it is prefix_argmin[d - 1]
+    S = np.cumsum(s, axis=1)
+    previous_min = np.concatenate((np.full((len(S), 1), np.inf), np.minimum.accumulate(S, axis=1)[:, :-1]), axis=1)
+    prefix_argmin = np.maximum.accumulate(np.where(S < previous_min, np.arange(S.shape[1]), 0), axis=1)
 
-    # If no change detected
-    return None, None, G, s
+    return s, G, prefix_argmin
 
-def iq_analysis(inputs, voltage, fs, time):
-    # Extract carrier frequency from input data
-    N = len(voltage)
-    fft_result = np.fft.fft(voltage)
-    freq = np.fft.fftfreq(N, 1/fs)
+
+def cusum_batch(signals, mu0, mu1, sigma, h, k):
+    """
+    Vectorized CUSUM over each row of a 2-D array of signals (e.g. the bins around the carrier, or several shots).
+    mu0, sigma, h and k are scalars or one value per row.
+    Returns:
+    - Detection index of each row, -1 where no change is detected
+    - Estimated change point index of each row, -1 where no change is detected
+    - Full G[k] array of each row (zero after the detection index)
+    - Score array s of each row
+    """
+    signals = np.atleast_2d(np.asarray(signals, dtype=float))
+    s, G, prefix_argmin = _cusum_statistics(signals, mu0, sigma, k)
+    rows = np.arange(len(G))
+
+    # first index after the start where G exceeds the threshold
+    above = G > _per_row(h)
+    above[:, 0] = False
+    detected = above.any(axis=1)
+    detect_idx = np.where(detected, np.argmax(above, axis=1), -1)
+    change_idx = np.where(detected, prefix_argmin[rows, detect_idx - 1], -1)
+
+    # the recursion stops at the detection index, leaving the rest of G zero
+    G[detected[:, None] & (np.arange(G.shape[1]) > detect_idx[:, None])] = 0
+
+    return detect_idx, change_idx, G, s
+
+
+def cusum_grid(signal, mu0, mu1, sigma, h, k):
+    """
+    Run CUSUM on one signal for every combination of threshold h and offset k.
+    Returns:
+    - Detection indices, shape (len(k), len(h)), -1 where no change is detected
+    - Estimated change point indices, same shape
+    """
+    h = np.atleast_1d(np.asarray(h, dtype=float))
+    k = np.atleast_1d(np.asarray(k, dtype=float))
+    signals = np.broadcast_to(np.asarray(signal, dtype=float), (len(k), len(signal)))
+    s, G, prefix_argmin = _cusum_statistics(signals, mu0, sigma, k)
+
+    # G does not depend on the threshold. the first index where it exceeds h is where its running maximum does, which is
+    # a binary search per threshold
+    G_max = np.maximum.accumulate(G, axis=1)
+    G_max[:, 0] = -np.inf
+    detect_idx = np.empty((len(k), len(h)), dtype=int)
+    for row in range(len(k)):
+        detect_idx[row] = np.searchsorted(G_max[row], h, side="right")
+
+    detected = detect_idx < G.shape[1]
+    detect_idx[~detected] = -1
+    change_idx = np.where(detected, np.take_along_axis(prefix_argmin, np.maximum(detect_idx - 1, 0), axis=1), -1)
+
+    return detect_idx, change_idx
+
+
+def iq_detection(voltage, fs, time, spectral=None, **inputs):
+    """
+    Detect the signal start time as the first drop of the IQ demodulated carrier amplitude below
+    iq_threshold_factor times its initial value. Pure computation, nothing is plotted. The spectrum of the record is
+    taken from spectral (a SpectralContext) when given.
+    Returns:
+    - IQResult with the start time, carrier frequency, threshold and the amplitude and phase envelopes
+    """
+    # Extract carrier frequency from input data. the spectrum of the real voltage is symmetric, so only the positive
+    # half is calculated
+    workers = fft_workers(**inputs)
+    if spectral is None:
+        spectral = SpectralContext(voltage, fs, **inputs)
+    fft_result = spectral.full_rfft
+    freq = spectral.full_rfft_freq
     positive_freq_mask = freq > 0
     positive_freq = freq[positive_freq_mask]
     positive_fft = np.abs(fft_result[positive_freq_mask])
@@ -250,106 +527,127 @@ def iq_analysis(inputs, voltage, fs, time):
     carrier_idx = np.argmax(positive_fft[freq_range_mask])
     carrier_frequency = positive_freq[freq_range_mask][carrier_idx]
 
-    logging.info(f"Extracted carrier frequency during IQ analysis: {carrier_frequency} Hz")
-    
-    # Demodulate signal
-    I = voltage * np.cos(2 * np.pi * carrier_frequency * time)
-    Q = voltage * np.sin(2 * np.pi * carrier_frequency * time)
+    logger.info(f"Extracted carrier frequency during IQ analysis: {carrier_frequency} Hz")
 
     # Apply Gaussian smoothing with skip points
     skip_points = 100 # skipping initial points to avoid IQ analysis induced signal drop
     window_length = 801
     window = np.exp(-0.5 * (np.arange(0, window_length) - (window_length - 1.0) / 2.0) / 10**2)
-    I_smooth = signal.convolve(I, window, mode='same')[skip_points:] / sum(window)
-    Q_smooth = signal.convolve(Q, window, mode='same')[skip_points:] / sum(window)
-    
-    # Calculate amplitude and phase
-    amplitude = np.sqrt(I_smooth**2 + Q_smooth**2)
-    phase = np.unwrap(np.arctan2(Q_smooth, I_smooth))
-
-    # Find initial stable amplitude
-    initial_amplitude = np.mean(amplitude[:int(len(amplitude)/4.5)])
 
     # Allow user-defined threshold factor via inputs; default to existing 0.4
     iq_threshold_factor = inputs['iq_threshold_factor']
-    threshold = iq_threshold_factor * initial_amplitude
-    
-    # Detect start time using 50% amplitude drop
-    start_index = np.where(amplitude < threshold)[0][0]
-    t_start_detected_iq = time[start_index]
-
-    # After calculating amplitude, adjust time array to match
-    time_adjusted = time[skip_points:skip_points+len(amplitude)]
-
-    # Convert amplitude to mV and time to microseconds
-    amplitude_mV = amplitude * 1e3
-    time_us = time_adjusted * 1e6
-
-    ###### Plot with matched array lengths and square aspect ratio
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(8, 8))
-    ax1.plot(time_us, amplitude_mV, label='Complex Amplitude')
-    
-    # Create the actual step function used for detection
-    # Before start time: amplitude is above threshold (normal)
-    # After start time: amplitude drops below threshold (detected)
-    step_function = np.where(time_us < t_start_detected_iq * 1e6, initial_amplitude * 1e3, threshold * 1e3)
-    ax1.plot(time_us, step_function, 'r--', linewidth=2, label='Detection Threshold')
-    ax1.axhline(y=threshold * 1e3, color='orange', linestyle=':', alpha=0.7, label=f'Threshold ({threshold*1e3:.1f} mV)')
-    ax1.axvline(x=t_start_detected_iq * 1e6, color='red', linestyle='-', linewidth=2, 
-                label=f'Start Time (IQ): {t_start_detected_iq*1e6:.1f} μs')
-    ax1.set_ylabel('Amplitude (mV)', fontsize=20)
-    ax1.set_xlabel('Time (μs)', fontsize=20)
-    ax1.legend(fontsize=12)
-    ax1.tick_params(axis='both', labelsize=20)
-
-    # Save IQ amplitude plot as a separate figure (only if plots are enabled)
-    save_all_plots = inputs.get("save_all_plots", "yes")
-    save_in_subfolder = inputs.get("save_plots_in_subfolder", True)
-    save_iq_start_time_plot = inputs.get('save_iq_start_time_plot', True)
-    
-    if save_all_plots == "yes" and save_iq_start_time_plot:
-        if save_in_subfolder:
-            # Create subfolder for this file's plots
-            base_filename = os.path.basename(inputs["filepath"])
-            name_without_ext, _ = os.path.splitext(base_filename)
-            plots_subfolder = os.path.join(inputs["out_files_dir"], f"{name_without_ext}_plots")
-            os.makedirs(plots_subfolder, exist_ok=True)
-            plot_dir = plots_subfolder
+
+    decimation = int(inputs.get("iq_decimation", 1))
+    if decimation > 1:
+        # demodulate and smooth at a reduced rate: every decimation-th sample of the full rate envelope
+        amplitude, phase, time_adjusted = iq_envelope_decimated(
+            voltage, time, carrier_frequency, window, skip_points, decimation, workers
+        )
+
+        # Find initial stable amplitude
+        initial_amplitude = np.mean(amplitude[:int(len(amplitude)/4.5)])
+        threshold = iq_threshold_factor * initial_amplitude
+
+        # Detect start time using 50% amplitude drop, interpolating linearly between the decimated samples either side
+        # of the crossing. the crossing is a fractional sample index of the full rate envelope
+        below = np.flatnonzero(amplitude < threshold)[0]
+        if below == 0:
+            start_index = 0.0
         else:
-            # Save plots in main output directory
-            plot_dir = inputs["out_files_dir"]
-        
-        # fname_prefix = os.path.splitext(inputs.get('filepath'))[0]
-        fig_iq, ax_iq = plt.subplots(figsize=(10, 6))
-        ax_iq.plot(time_us, amplitude_mV, label='Complex Amplitude', linewidth=1.5)
-        
-        # Create the actual step function used for detection
-        # Before start time: amplitude is above threshold (normal)
-        # After start time: amplitude drops below threshold (detected)
-        step_function = np.where(time_us < t_start_detected_iq * 1e6, initial_amplitude * 1e3, threshold * 1e3)
-        ax_iq.plot(time_us, step_function, 'r--', linewidth=2, label='Detection Step Function')
-        ax_iq.axhline(y=threshold * 1e3, color='orange', linestyle=':', alpha=0.7, linewidth=2, 
-                    label=f'Detection Threshold ({threshold*1e3:.1f} mV)')
-        ax_iq.axvline(x=t_start_detected_iq * 1e6, color='red', linestyle='-', linewidth=3, 
-                    label=f'Start Time Detected: {t_start_detected_iq*1e6:.1f} μs')
-        
-        ax_iq.set_ylabel('Amplitude (mV)', fontsize=16)
-        ax_iq.set_xlabel('Time (μs)', fontsize=16)
-        ax_iq.set_title('IQ Analysis: Start Time Detection', fontsize=18, fontweight='bold')
-        ax_iq.legend(fontsize=12, loc='upper right')
-        ax_iq.tick_params(axis='both', labelsize=14)
-        ax_iq.grid(True, alpha=0.3)
-        plt.tight_layout()
-        if inputs['save_data'] == "yes":
-            fig_iq.savefig(os.path.join(plot_dir, f"{name_without_ext}-IQ_start_time_detection.png"), dpi=inputs.get('plot_dpi', 300), format='png', facecolor='w')
-        plt.close(fig_iq)
-
-    # Adjust phase plotting similarly
-    ax2.plot(time_us, phase, label='Phase', color='green')
-    ax2.set_xlabel('Time (μs)', fontsize=20)
-    ax2.set_ylabel('Phase (radians)', fontsize=20)
-    ax2.legend(fontsize=12)
-    ax2.tick_params(axis='both', labelsize=20)
-    plt.tight_layout()
-
-    return t_start_detected_iq, amplitude, phase
\ No newline at end of file
+            frac = (amplitude[below - 1] - threshold) / (amplitude[below - 1] - amplitude[below])
+            start_index = (below - 1 + frac) * decimation
+        t_start_detected_iq = time[int(start_index)] + (start_index - int(start_index)) / fs
+    else:
+        # Demodulate signal
+        I = voltage * np.cos(2 * np.pi * carrier_frequency * time)
+        Q = voltage * np.sin(2 * np.pi * carrier_frequency * time)
+
+        with set_workers(workers):
+            I_smooth = signal.convolve(I, window, mode='same')[skip_points:] / sum(window)
+            Q_smooth = signal.convolve(Q, window, mode='same')[skip_points:] / sum(window)
+
+        # Calculate amplitude and phase
+        amplitude = np.sqrt(I_smooth**2 + Q_smooth**2)
+        phase = np.unwrap(np.arctan2(Q_smooth, I_smooth))
+
+        # Find initial stable amplitude
+        initial_amplitude = np.mean(amplitude[:int(len(amplitude)/4.5)])
+        threshold = iq_threshold_factor * initial_amplitude
+
+        # Detect start time using 50% amplitude drop
+        start_index = np.where(amplitude < threshold)[0][0]
+        t_start_detected_iq = time[start_index]
+
+        # After calculating amplitude, adjust time array to match
+        time_adjusted = time[skip_points:skip_points+len(amplitude)]
+
+    return IQResult(
+        t_start_detected=t_start_detected_iq,
+        carrier_frequency=carrier_frequency,
+        initial_amplitude=initial_amplitude,
+        threshold=threshold,
+        time=time_adjusted,
+        amplitude=amplitude,
+        phase=phase,
+    )
+
+
+def iq_analysis(inputs, voltage, fs, time):
+    """
+    IQ start time detection returning the start time and the amplitude and phase envelopes.
+    See iq_detection for the full result; the diagnostic plot is drawn by alpss.plotting.iq.plot_iq_detection
+    """
+    iq_out = iq_detection(voltage, fs, time, **inputs)
+    return iq_out.t_start_detected, iq_out.amplitude, iq_out.phase
+
+
+def iq_envelope_decimated(voltage, time, carrier_frequency, window, skip_points, decimation, workers=None):
+    """
+    Amplitude and phase envelopes of iq_analysis at a reduced rate.
+    Mixing to baseband and then smoothing with the window is the same as filtering the voltage with the window moved
+    to the carrier and mixing afterwards, so only the kept samples are mixed. The filter is applied in the frequency
+    domain, and the spectrum is folded onto the decimated grid so that the inverse transform has
+    len(voltage) / decimation points. Sample j is sample j * decimation of the full rate envelope, which starts
+    skip_points into the 'same' mode convolution. The time axis is taken as uniformly sampled.
+    Returns:
+    - Decimated amplitude envelope
+    - Decimated (unwrapped) phase envelope
+    - Time of each decimated sample
+    """
+    n = len(voltage)
+    taps = len(window)
+    dt = (time[-1] - time[0]) / (n - 1)
+    omega = 2 * np.pi * carrier_frequency * dt
+
+    # sum_m w[m] v[p - m] exp(i omega (p - m)) = exp(i omega p) sum_m w[m] exp(-i omega m) v[p - m]
+    kernel = window * np.exp(-1j * omega * np.arange(taps))
+
+    # full rate envelope sample j is 'full' mode convolution sample j + offset. the transform is long enough for the
+    # linear convolution (no wrap-around reaches the kept samples) and a multiple of the decimation factor
+    offset = skip_points + (taps - 1) // 2
+    count = -(-(n - skip_points) // decimation)
+    length = decimation * next_fast_len(-(-(n + taps - 1) // decimation))
+
+    # the kernel is placed circularly shifted by offset, so that envelope sample 0 is sample 0 of the convolution
+    shifted = np.zeros(length, dtype=complex)
+    shifted[(np.arange(taps) - offset) % length] = kernel
+
+    spectrum = rfft(voltage, length, workers=workers)
+    # the voltage is real, so the negative frequencies are the conjugate of the positive ones
+    spectrum = np.concatenate((spectrum, np.conj(spectrum[1:(length + 1) // 2][::-1])))
+    spectrum *= fft(shifted, workers=workers)
+
+    # folding the spectrum onto length / decimation bins keeps every decimation-th sample of the convolution
+    folded = spectrum.reshape(decimation, length // decimation).sum(axis=0)
+    smooth = ifft(folded, workers=workers)[:count] / decimation
+
+    # mix the kept samples to baseband
+    kept = offset + decimation * np.arange(count)
+    smooth *= np.exp(1j * (2 * np.pi * carrier_frequency * time[0] + omega * kept)) / sum(window)
+
+    amplitude = np.abs(smooth)
+    phase = np.unwrap(np.angle(smooth))
+    time_decimated = time[skip_points:skip_points + count * decimation:decimation]
+
+    return amplitude, phase, time_decimated
+
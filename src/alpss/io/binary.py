@@ -0,0 +1,58 @@
+import io
+import os
+import numpy as np
+
+# default sample dtypes for raw binary traces, keyed by file extension
+RAW_DTYPES = {".bin": "float32", ".raw": "float32", ".f32": "float32", ".f64": "float64"}
+
+
+# memory-map a binary trace so that only the pages of the requested window are ever read from disk. .npy files carry
+# their own dtype and shape; raw files are a flat stream of samples, either amplitude only (one column) or interleaved
+# time/amplitude pairs (two columns). source is either a file path or the raw bytes of the file
+def open_binary(fmt, source, **inputs):
+    in_memory = isinstance(source, bytes)
+
+    if fmt == "npy":
+        if in_memory:
+            samples = np.load(io.BytesIO(source))
+        else:
+            samples = np.load(source, mmap_mode="r")
+
+    elif fmt == "raw":
+        ext = os.path.splitext(str(inputs.get("filepath", "")))[1].lower()
+        dtype = np.dtype(inputs.get("binary_dtype") or RAW_DTYPES.get(ext, "float32"))
+        offset = int(inputs.get("binary_offset", 0))
+        if in_memory:
+            samples = np.frombuffer(source, dtype=dtype, offset=offset)
+        else:
+            samples = np.memmap(source, dtype=dtype, mode="r", offset=offset)
+
+        columns = int(inputs.get("binary_columns", 1))
+        if columns not in (1, 2):
+            raise ValueError(f"'binary_columns' must be 1 (amplitude) or 2 (time, amplitude), got {columns}")
+        if columns == 2:
+            samples = samples[: samples.size - samples.size % 2].reshape(-1, 2)
+
+    else:
+        raise ValueError(f"Unsupported binary format: {fmt}")
+
+    if samples.ndim not in (1, 2) or (samples.ndim == 2 and samples.shape[1] != 2):
+        raise ValueError(f"Binary traces must have shape (n,) or (n, 2), got {samples.shape}")
+
+    return samples
+
+
+# slice the window [first, first + nrows) out of a (memory-mapped) trace and return it as Time/Ampl columns. traces
+# that only store the amplitude get a time column synthesized from the sample rate. with_time=False skips the time
+# column entirely (returned as None)
+def binary_window(samples, first, nrows, sample_rate, with_time=True):
+    window = samples[first : first + nrows]
+
+    if window.ndim == 1:
+        voltage = np.asarray(window, dtype=np.float64)
+        time = (first + np.arange(window.shape[0])) / sample_rate if with_time else None
+    else:
+        voltage = np.asarray(window[:, 1], dtype=np.float64)
+        time = np.asarray(window[:, 0], dtype=np.float64) if with_time else None
+
+    return time, voltage
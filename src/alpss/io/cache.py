@@ -0,0 +1,127 @@
+import io
+import os
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger("alpss")
+
+# default upper bound on the total size of the cache directory
+DEFAULT_MAX_BYTES = 4 * 1024**3
+
+
+# cache location: the 'cache_dir' input, then $ALPSS_CACHE_DIR, then the user cache directory
+def cache_dir(**inputs):
+    path = inputs.get("cache_dir") or os.environ.get("ALPSS_CACHE_DIR")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "alpss")
+    return path
+
+
+# hash the raw bytes of a file path or bytestring. the key does not depend on the file name or mtime, so a trace that
+# is copied or re-uploaded still hits the cache
+def content_hash(source, chunk_size=1 << 24):
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(source, bytes):
+        h.update(source)
+    else:
+        with open(source, "rb") as fh:
+            for chunk in iter(lambda: fh.read(chunk_size), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+# list the cache entries as (path, size in bytes, last used time), least recently used first
+def cache_entries(path):
+    if not os.path.isdir(path):
+        return []
+    entries = []
+    for name in os.listdir(path):
+        if name.endswith(".npy"):
+            full = os.path.join(path, name)
+            stat = os.stat(full)
+            entries.append((full, stat.st_size, stat.st_mtime))
+    return sorted(entries, key=lambda entry: entry[2])
+
+
+# delete least recently used entries until the cache fits in max_bytes. entries in keep are never removed
+def evict(path, max_bytes, keep=()):
+    entries = cache_entries(path)
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for full, size, _ in entries:
+        if total <= max_bytes:
+            break
+        if full in keep:
+            continue
+        os.remove(full)
+        total -= size
+        removed.append(full)
+    return removed
+
+
+# return every parsed column of a csv trace as an (n, 2) float64 array, memory-mapped from the cache. on a miss the
+# whole file is parsed once (all rows after the header lines) and written to the cache so that later runs with any
+# time_to_skip/time_to_take window only touch the rows they need. returns None if the file cannot be cached
+def cached_columns(source, **inputs):
+    path = cache_dir(**inputs)
+    key = f"{content_hash(source)}-h{int(inputs['header_lines'])}"
+    entry = os.path.join(path, f"{key}.npy")
+
+    if os.path.exists(entry):
+        # touching the entry marks it as recently used for the LRU eviction
+        os.utime(entry)
+        return np.load(entry, mmap_mode="r")
+
+    try:
+        data = pd.read_csv(
+            io.BytesIO(source) if isinstance(source, bytes) else source,
+            skiprows=int(inputs["header_lines"]),
+            header=None,
+        ).to_numpy(dtype=np.float64)
+    except ValueError as e:
+        logger.warning("Trace could not be parsed for caching, reading it directly: %s", str(e))
+        return None
+    if data.ndim != 2 or data.shape[1] != 2:
+        logger.warning("Only two column (time, amplitude) traces are cached, got %d columns", data.shape[1])
+        return None
+
+    # write to a temporary name and rename so a concurrent run never sees a partial entry
+    os.makedirs(path, exist_ok=True)
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        np.save(fh, data)
+    os.replace(tmp, entry)
+    evict(path, inputs.get("cache_max_bytes", DEFAULT_MAX_BYTES), keep=(entry,))
+
+    return np.load(entry, mmap_mode="r")
+
+
+# command line helpers for inspecting and purging the cache
+def cache_info(path):
+    entries = cache_entries(path)
+    lines = [f"cache directory: {path}"]
+    for full, size, used in entries:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(used))
+        lines.append(f"  {os.path.basename(full)}  {size / 1024**2:10.1f} MB  last used {stamp}")
+    total = sum(size for _, size, _ in entries)
+    lines.append(f"{len(entries)} entries, {total / 1024**2:.1f} MB total")
+    return "\n".join(lines)
+
+
+# delete the entries unused for more than older_than seconds, then the least recently used entries until the cache fits
+# in max_bytes. with neither limit the whole cache is cleared
+def purge(path, older_than=None, max_bytes=None):
+    removed = []
+    if older_than is not None or max_bytes is None:
+        cutoff = None if older_than is None else time.time() - older_than
+        for full, _, used in cache_entries(path):
+            if cutoff is None or used < cutoff:
+                os.remove(full)
+                removed.append(full)
+    if max_bytes is not None:
+        removed += evict(path, max_bytes)
+    return removed
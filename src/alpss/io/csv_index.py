@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger("alpss")
+
+# the sidecar index lives next to the trace as <filename>.alpssidx.npz
+INDEX_SUFFIX = ".alpssidx.npz"
+
+# number of lines between stored offsets. a sparse index keeps the sidecar small (8 bytes per 1024 lines) while
+# seeking never has to read more than stride - 1 lines past the nearest stored offset
+DEFAULT_STRIDE = 1024
+
+
+# scan the file once and record the byte offset of the start of every stride-th line (line 0, stride, 2*stride, ...)
+def build_line_index(filepath, stride=DEFAULT_STRIDE, chunk_size=1 << 24):
+    offsets = [np.zeros(1, dtype=np.int64)]
+    line_count = 0
+    pos = 0
+    with open(filepath, "rb") as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+
+            # newline j in this chunk ends line (line_count + j) and starts line (line_count + j + 1). keep the
+            # newlines whose following line is a multiple of the stride
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            first = -(line_count + 1) % stride
+            offsets.append(pos + newlines[first::stride].astype(np.int64) + 1)
+
+            line_count += len(newlines)
+            pos += len(chunk)
+
+    return np.concatenate(offsets)
+
+
+# load the sidecar index for a file, rebuilding it when it is missing or the file size/mtime no longer match
+def line_index(filepath, stride=DEFAULT_STRIDE):
+    stat = os.stat(filepath)
+    sidecar = filepath + INDEX_SUFFIX
+
+    try:
+        with np.load(sidecar) as idx:
+            if (
+                int(idx["size"]) == stat.st_size
+                and int(idx["mtime_ns"]) == stat.st_mtime_ns
+                and int(idx["stride"]) == stride
+            ):
+                return idx["offsets"]
+    except (OSError, KeyError, ValueError):
+        pass
+
+    offsets = build_line_index(filepath, stride)
+    try:
+        with open(sidecar, "wb") as fh:
+            np.savez(fh, size=stat.st_size, mtime_ns=stat.st_mtime_ns, stride=stride, offsets=offsets)
+    except OSError as e:
+        # a read-only data directory only costs the rebuild on the next run
+        logger.warning("Could not write csv index %s: %s", sidecar, str(e))
+
+    return offsets
+
+
+# read nrows of csv data after skipping skiprows lines, seeking straight to the first wanted line instead of having
+# pandas tokenize everything before it. returns exactly what pd.read_csv(filepath, skiprows=skiprows, nrows=nrows)
+# returns, including taking the first unskipped line as the column names
+def read_csv_window(filepath, skiprows, nrows, stride=DEFAULT_STRIDE, usecols=None):
+    offsets = line_index(filepath, stride)
+
+    with open(filepath, "rb") as fh:
+        k = min(skiprows // stride, len(offsets) - 1)
+        fh.seek(int(offsets[k]))
+        for _ in range(skiprows - k * stride):
+            fh.readline()
+        return pd.read_csv(fh, nrows=nrows, usecols=usecols)
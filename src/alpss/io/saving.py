@@ -67,10 +67,11 @@ def save(
         )
         smooth_velocity_assets.append(smooth_velocity_path)
 
-    # save the filtered voltage data
+    # save the filtered voltage data. with the 'roi' velocity window it only covers the domain of interest
+    offset = vc_out.get("voltage_filt_offset", 0)
     voltage_data = np.stack(
         (
-            sdf_out["time"],
+            sdf_out["time"][offset:offset + len(vc_out["voltage_filt"])],
             np.real(vc_out["voltage_filt"]),
             np.imag(vc_out["voltage_filt"]),
         ),
@@ -0,0 +1,170 @@
+import re
+import struct
+import numpy as np
+from dataclasses import dataclass
+
+# file extensions of the oscilloscope formats that can be read natively
+SCOPE_FORMATS = {".trc": "trc", ".wfm": "wfm", ".isf": "isf"}
+
+
+@dataclass
+class ScopeTrace:
+    """Waveform decoded from a binary oscilloscope file.
+
+    ``raw`` holds the stored sample codes (memory-mapped when read from disk) and the voltage is
+    ``raw * gain + offset``. Sample ``i`` is taken at ``t0 + i * dt``.
+    """
+
+    raw: np.ndarray
+    gain: float
+    offset: float
+    dt: float
+    t0: float
+
+    def voltage(self, start=0, stop=None):
+        """Return the scaled voltage of samples ``start:stop`` as float64."""
+        return self.raw[start:stop] * np.float64(self.gain) + np.float64(self.offset)
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+
+# read the first nbytes of a file path or bytestring, enough to decode the header
+def _head(source, nbytes):
+    if isinstance(source, bytes):
+        return source[:nbytes]
+    with open(source, "rb") as fh:
+        return fh.read(nbytes)
+
+
+# map the sample block of a file path or bytestring without copying it
+def _samples(source, dtype, offset, count):
+    if isinstance(source, bytes):
+        return np.frombuffer(source, dtype=dtype, count=count, offset=offset)
+    return np.memmap(source, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+# LeCroy .trc files: an optional '#9nnnnnnnnn' block prefix, the 346 byte WAVEDESC descriptor, then the user text,
+# trigger time and RIS time arrays, then the first data array. voltage = VERTICAL_GAIN * code - VERTICAL_OFFSET
+def read_trc(source):
+    head = _head(source, 512)
+    start = head.find(b"WAVEDESC")
+    if start < 0:
+        raise ValueError("Not a LeCroy trc file: WAVEDESC block not found")
+
+    # COMM_ORDER is 0 for big endian (HIFIRST) and 1 for little endian (LOFIRST). it is stored in the file's own byte
+    # order, so a little endian 1 reads as 256 when decoded big endian
+    e = "<" if struct.unpack_from("<h", head, start + 34)[0] == 1 else ">"
+
+    comm_type = struct.unpack_from(e + "h", head, start + 32)[0]
+    wave_descriptor, user_text, _, trigtime_array, ris_time_array, _, wave_array_1 = struct.unpack_from(
+        e + "7l", head, start + 36
+    )
+    gain, offset = struct.unpack_from(e + "2f", head, start + 156)
+    horiz_interval = struct.unpack_from(e + "f", head, start + 176)[0]
+    horiz_offset = struct.unpack_from(e + "d", head, start + 180)[0]
+
+    dtype = np.dtype(e + ("i1" if comm_type == 0 else "i2"))
+    data_start = start + wave_descriptor + user_text + trigtime_array + ris_time_array
+    raw = _samples(source, dtype, data_start, wave_array_1 // dtype.itemsize)
+
+    return ScopeTrace(raw=raw, gain=gain, offset=-offset, dt=horiz_interval, t0=horiz_offset)
+
+
+# preamble fields in Tektronix .isf headers may be written long (BYT_NR, XINCR) or short (BYT_N, XIN), with or
+# without a ':WFMPRE:'/':WFMOUTPRE:' prefix. look them up by their short mnemonic
+def _isf_field(fields, short, default=None):
+    for key, value in fields.items():
+        if key.startswith(short):
+            return value
+    if default is None:
+        raise ValueError(f"Tektronix isf header is missing the {short} field")
+    return default
+
+
+# Tektronix .isf files: the ascii WFMPRE preamble followed by a CURVE #<n><length> binary block.
+# voltage = (code - YOFF) * YMULT + YZERO and time = XZERO + (i - PT_OFF) * XINCR
+def read_isf(source):
+    head = _head(source, 8192)
+    curve = head.upper().find(b"CURVE")
+    block = head.find(b"#", curve if curve >= 0 else 0)
+    if block < 0:
+        raise ValueError("Not a Tektronix isf file: binary block not found")
+
+    ndigits = int(head[block + 1 : block + 2])
+    nbytes = int(head[block + 2 : block + 2 + ndigits])
+    data_start = block + 2 + ndigits
+
+    # split the preamble on semicolons that are not inside a quoted string (the WFID description may contain them)
+    fields = {}
+    for part in re.split(r';(?=(?:[^"]*"[^"]*")*[^"]*$)', head[:curve if curve >= 0 else block].decode("latin-1")):
+        key, _, value = part.strip().partition(" ")
+        if key:
+            fields[key.split(":")[-1].upper()] = value.strip().strip('"')
+
+    if not _isf_field(fields, "ENC", "BIN").upper().startswith("BIN"):
+        raise ValueError("Only binary encoded Tektronix isf files are supported")
+
+    byte_nr = int(_isf_field(fields, "BYT_N"))
+    kind = {"RI": "i", "RP": "u", "FP": "f"}[_isf_field(fields, "BN_F", "RI").upper()]
+    e = ">" if _isf_field(fields, "BYT_O", "MSB").upper() == "MSB" else "<"
+    dtype = np.dtype(f"{e}{kind}{byte_nr}")
+
+    count = min(int(_isf_field(fields, "NR_P", str(nbytes // byte_nr))), nbytes // byte_nr)
+    raw = _samples(source, dtype, data_start, count)
+
+    ymult = float(_isf_field(fields, "YMU"))
+    yoff = float(_isf_field(fields, "YOF", "0"))
+    yzero = float(_isf_field(fields, "YZE", "0"))
+    xincr = float(_isf_field(fields, "XIN"))
+    xzero = float(_isf_field(fields, "XZE", "0"))
+    pt_off = float(_isf_field(fields, "PT_O", "0"))
+
+    return ScopeTrace(raw=raw, gain=ymult, offset=yzero - yoff * ymult, dt=xincr, t0=xzero - pt_off * xincr)
+
+
+# sample formats of the explicit dimension in Tektronix .wfm files
+_WFM_FORMATS = {0: "i2", 1: "i4", 2: "u4", 3: "u8", 4: "f4", 5: "f8", 6: "u1", 7: "i1"}
+
+
+# Tektronix .wfm files (WFM#002/WFM#003, written by TDS5000/DPO/MSO series scopes): a fixed 838 byte header followed
+# by the curve buffer. the valid record sits between the data start and postcharge start offsets of the curve
+# buffer, with precharge/postcharge points on either side. voltage = code * dim_scale + dim_offset
+def read_wfm(source):
+    head = _head(source, 838)
+    if len(head) < 838:
+        raise ValueError("Not a Tektronix wfm file: header is truncated")
+
+    byte_order = struct.unpack_from("<H", head, 0)[0]
+    if byte_order not in (0x0F0F, 0xF0F0):
+        raise ValueError("Not a Tektronix wfm file: bad byte order marker")
+    e = "<" if byte_order == 0x0F0F else ">"
+
+    version = head[2:10]
+    if version not in (b":WFM#002", b":WFM#003"):
+        raise ValueError(f"Unsupported Tektronix wfm version: {version!r}")
+
+    bytes_per_point = head[15]
+    curve_offset = struct.unpack_from(e + "l", head, 16)[0]
+    vscale, voffset = struct.unpack_from(e + "2d", head, 168)
+    fmt = struct.unpack_from(e + "l", head, 240)[0]
+    hscale, hoffset = struct.unpack_from(e + "2d", head, 488)
+    data_start, postcharge_start = struct.unpack_from(e + "2L", head, 822)
+
+    if fmt not in _WFM_FORMATS:
+        raise ValueError(f"Unsupported Tektronix wfm sample format: {fmt}")
+    dtype = np.dtype(e + _WFM_FORMATS[fmt])
+    if dtype.itemsize != bytes_per_point:
+        raise ValueError("Tektronix wfm sample format does not match the bytes per point")
+
+    count = (postcharge_start - data_start) // dtype.itemsize
+    raw = _samples(source, dtype, curve_offset + data_start, count)
+
+    return ScopeTrace(raw=raw, gain=vscale, offset=voffset, dt=hscale, t0=hoffset)
+
+
+def read_scope(fmt, source):
+    readers = {"trc": read_trc, "isf": read_isf, "wfm": read_wfm}
+    if fmt not in readers:
+        raise ValueError(f"Unsupported oscilloscope format: {fmt}")
+    return readers[fmt](source)
@@ -1,2 +1,3 @@
 from alpss.plotting.plots import plot_results, plot_voltage
 from alpss.plotting.hel import plot_hel_detection
+from alpss.plotting.iq import plot_iq_detection
@@ -0,0 +1,58 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def plot_iq_detection(iq_result):
+    """
+    Generate the IQ start time detection diagnostic plot.
+
+    Parameters
+    ----------
+    iq_result : IQResult
+        Result from iq_detection().
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        The diagnostic figure.
+    """
+    t_start = iq_result.t_start_detected
+    threshold = iq_result.threshold
+
+    # Convert amplitude to mV and time to microseconds
+    amplitude_mV = iq_result.amplitude * 1e3
+    time_us = np.asarray(iq_result.time) * 1e6
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.plot(time_us, amplitude_mV, label="Complex Amplitude", linewidth=1.5)
+
+    # Create the actual step function used for detection
+    # Before start time: amplitude is above threshold (normal)
+    # After start time: amplitude drops below threshold (detected)
+    step_function = np.where(time_us < t_start * 1e6, iq_result.initial_amplitude * 1e3, threshold * 1e3)
+    ax.plot(time_us, step_function, "r--", linewidth=2, label="Detection Step Function")
+    ax.axhline(
+        y=threshold * 1e3,
+        color="orange",
+        linestyle=":",
+        alpha=0.7,
+        linewidth=2,
+        label=f"Detection Threshold ({threshold * 1e3:.1f} mV)",
+    )
+    ax.axvline(
+        x=t_start * 1e6,
+        color="red",
+        linestyle="-",
+        linewidth=3,
+        label=f"Start Time Detected: {t_start * 1e6:.1f} μs",
+    )
+
+    ax.set_ylabel("Amplitude (mV)", fontsize=16)
+    ax.set_xlabel("Time (μs)", fontsize=16)
+    ax.set_title("IQ Analysis: Start Time Detection", fontsize=18, fontweight="bold")
+    ax.legend(fontsize=12, loc="upper right")
+    ax.tick_params(axis="both", labelsize=14)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    return fig
@@ -2,7 +2,9 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 import pandas as pd
 import os
-from alpss.utils import stft
+from alpss.spectral import stft
+from alpss.spectral import PowerSpectrogram, power_dtype
+from alpss.velocity.calculation import voltage_filt_time
 import numpy as np
 import random
 import string
@@ -51,7 +53,7 @@ def plot_results(
         c="tab:blue",
     )
     ax1.plot(
-        sdf_out["time"] / 1e-9,
+        voltage_filt_time(sdf_out, vc_out) / 1e-9,
         np.real(vc_out["voltage_filt"]) * 1e3,
         label="Filtered Signal",
         c="tab:orange",
@@ -89,7 +91,7 @@ def plot_results(
 
     #################### imported voltage spectrogram and a rectangle to show the ROI
     plt3 = ax3.imshow(
-        10 * np.log10(sdf_out["mag"] ** 2),
+        sdf_out["power"].values,
         aspect="auto",
         origin="lower",
         interpolation="none",
@@ -147,7 +149,7 @@ def plot_results(
 
     #################### plotting the spectrogram of the ROI with the start-time line to see how well it lines up
     plt5 = ax5.imshow(
-        10 * np.log10(sdf_out["mag"] ** 2),
+        sdf_out["power"].values,
         aspect="auto",
         origin="lower",
         interpolation="none",
@@ -199,7 +201,7 @@ def plot_results(
 
     #################### voltage in the ROI and the signal envelope
     ax7.plot(
-        sdf_out["time"] / 1e-9,
+        voltage_filt_time(sdf_out, vc_out) / 1e-9,
         np.real(vc_out["voltage_filt"]) * 1e3,
         label="Filtered Signal",
         c="tab:blue",
@@ -415,22 +417,30 @@ def plot_results(
 
 def plot_voltage(data, **inputs):
 
-    # rename the columns of the data
-    data.columns = ["Time", "Ampl"]
+    if inputs.get("time_axis", "column") == "synthesized":
+        # only the amplitude column was read, rebuild time from the sample rate
+        voltage = data.iloc[:, -1].to_numpy()
+        fs = inputs["sample_rate"]
+        time = np.arange(len(voltage)) / fs
+
+    else:
+        # rename the columns of the data
+        data.columns = ["Time", "Ampl"]
 
-    # put the data into numpy arrays. Zero the time data
-    time = data["Time"].to_numpy()
-    time = time - time[0]
-    voltage = data["Ampl"].to_numpy()
+        # put the data into numpy arrays. Zero the time data
+        time = data["Time"].to_numpy()
+        time = time - time[0]
+        voltage = data["Ampl"].to_numpy()
 
-    # calculate the sample rate from the experimental data
-    fs = 1 / np.mean(np.diff(time))
+        # calculate the sample rate from the experimental data
+        fs = 1 / np.mean(np.diff(time))
 
     # calculate the short time fourier transform
     f, t, Zxx = stft(voltage, fs, **inputs)
 
-    # calculate magnitude of Zxx
+    # calculate magnitude and power of Zxx
     mag = np.abs(Zxx)
+    power = PowerSpectrogram(magnitude=mag, dtype=power_dtype(**inputs)).values
 
     # plotting
     fig, (ax1, ax2) = plt.subplots(1, 2, num=2, figsize=(11, 4), dpi=300, clear=True)
@@ -438,7 +448,7 @@ def plot_voltage(data, **inputs):
     ax1.set_xlabel("Time (ns)")
     ax1.set_ylabel("Voltage (mV)")
     ax2.imshow(
-        10 * np.log10(mag**2),
+        power,
         aspect="auto",
         origin="lower",
         interpolation="none",
@@ -0,0 +1,411 @@
+import numpy as np
+from functools import cached_property, lru_cache
+from scipy.fft import get_workers, set_workers, fft, ifft, rfft, rfftfreq, fftshift, next_fast_len
+from scipy.signal import ShortTimeFFT, CZT
+
+
+class SpectralContext:
+    """Spectral products of one record, shared by the start time detectors and the carrier frequency estimate.
+
+    Every product is computed the first time it is needed and then reused, so running several detectors on the
+    same shot (see ``alpss.detection.spall_doi_finder.compare_start_detectors``) transforms the record only once.
+    """
+
+    def __init__(self, voltage, fs, **inputs):
+        self.voltage = voltage
+        self.fs = fs
+        self.inputs = inputs
+        self._carrier_ffts = {}
+
+    def carrier_window_length(self, carrier_band_time):
+        """Number of samples in the carrier band window, the first ``carrier_band_time`` of the record."""
+        return int(round(carrier_band_time * self.fs))
+
+    def carrier_fft(self, n, length=None):
+        """FFT of the first ``n`` samples of the record (the carrier band window), zero padded or cropped to
+        ``length`` points when given."""
+        if length == n:
+            length = None
+        if (n, length) not in self._carrier_ffts:
+            self._carrier_ffts[n, length] = fft(self.voltage[:n], n=length, workers=fft_workers(**self.inputs))
+        return self._carrier_ffts[n, length]
+
+    @cached_property
+    def full_length(self):
+        """Transform length of ``full_rfft`` under the fft_padding policy (``fft_length``)."""
+        return fft_length(len(self.voltage), real=True, trim=True, **self.inputs)
+
+    @cached_property
+    def full_rfft(self):
+        """One-sided FFT of the whole record."""
+        return rfft(self.voltage, n=self.full_length, workers=fft_workers(**self.inputs))
+
+    @cached_property
+    def full_rfft_freq(self):
+        """Frequencies of ``full_rfft``."""
+        return rfftfreq(self.full_length, 1 / self.fs)
+
+    @cached_property
+    def grid(self):
+        """The frequency and time arrays of ``spectrogram`` as ``(f, t)``, without calculating it."""
+        return stft_grid(len(self.voltage), self.fs, **self.inputs)
+
+    @cached_property
+    def spectrogram(self):
+        """The legacy stft of the record as ``(f, t, Zxx)``."""
+        return stft(self.voltage, self.fs, **self.inputs)
+
+    @cached_property
+    def magnitude(self):
+        """Magnitude of the stft."""
+        return np.abs(self.spectrogram[2])
+
+    @cached_property
+    def power(self):
+        """dB power of the stft as a ``PowerSpectrogram``."""
+        return PowerSpectrogram(magnitude=self.magnitude, dtype=power_dtype(**self.inputs))
+
+
+def power_dtype(**inputs):
+    """Floating point type of the dB spectrograms, set by the power_dtype input (default float64)."""
+    return np.dtype(inputs.get("power_dtype", "float64"))
+
+
+class PowerSpectrogram:
+    """dB power of a spectrogram, ``20 * log10(|Zxx|)``.
+
+    The power is computed the first time ``values`` is read and then shared by the start time detection, the
+    filtered spectrogram and the plots. It is built from either the complex ``Zxx`` (whose magnitude is a temporary
+    that is overwritten in place) or an existing ``magnitude`` array (which is left untouched). A float32 ``dtype``
+    halves the memory of the result.
+    """
+
+    def __init__(self, Zxx=None, magnitude=None, dtype=np.float64):
+        if (Zxx is None) == (magnitude is None):
+            raise ValueError("PowerSpectrogram needs exactly one of Zxx or magnitude")
+        self._Zxx = Zxx
+        self._magnitude = magnitude
+        self.dtype = np.dtype(dtype)
+
+    @cached_property
+    def values(self):
+        """The dB power array."""
+        if self._magnitude is None:
+            power = np.abs(self._Zxx)
+            if power.dtype != self.dtype:
+                power = power.astype(self.dtype)
+            np.log10(power, out=power)
+        else:
+            power = np.log10(self._magnitude, out=np.empty(self._magnitude.shape, dtype=self.dtype))
+        power *= 20
+        return power
+
+    @property
+    def shape(self):
+        return (self._Zxx if self._magnitude is None else self._magnitude).shape
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+
+def peak_offset(spectrum, k, method="parabolic"):
+    """Fractional bin offset, within [-0.5, 0.5], of the spectral peak at index ``k`` of ``spectrum``.
+
+    ``"parabolic"`` and ``"gaussian"`` fit a parabola through the magnitude and log magnitude of the peak bin and its
+    two neighbours. ``"jacobsen"`` uses the complex values of the three bins and is exact for a rectangular window.
+    For a 2-D spectrum (frequency along the first axis), ``k`` holds the peak index of every column. Peaks on the
+    first or last bin are not refined.
+    """
+    spectrum = np.asarray(spectrum)
+    k = np.asarray(k)
+    inside = (k > 0) & (k < spectrum.shape[0] - 1)
+    kc = np.clip(k, 1, spectrum.shape[0] - 2)
+    if spectrum.ndim == 1:
+        a, b, c = spectrum[kc - 1], spectrum[kc], spectrum[kc + 1]
+    else:
+        cols = np.arange(spectrum.shape[1])
+        a, b, c = spectrum[kc - 1, cols], spectrum[kc, cols], spectrum[kc + 1, cols]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "jacobsen":
+            delta = np.real((a - c) / (2 * b - a - c))
+        elif method in ("parabolic", "gaussian"):
+            a, b, c = np.abs(a), np.abs(b), np.abs(c)
+            if method == "gaussian":
+                a, b, c = np.log(a), np.log(b), np.log(c)
+            delta = 0.5 * (a - c) / (a - 2 * b + c)
+        else:
+            raise ValueError(f"peak_interpolation must be 'parabolic', 'gaussian' or 'jacobsen', not {method!r}")
+
+    delta = np.where(inside & np.isfinite(delta), np.clip(delta, -0.5, 0.5), 0.0)
+    return float(delta) if delta.ndim == 0 else delta
+
+
+# number of threads used by the scipy.fft calls of a run, set with the 'fft_workers' input (-1 uses every core).
+# defaults to the current scipy.fft setting, which is single threaded unless changed with scipy.fft.set_workers
+def fft_workers(**inputs):
+    workers = inputs.get("fft_workers")
+    return get_workers() if workers is None else int(workers)
+
+
+# number of full record frequency grids kept between calls. each is as long as the record
+FFT_GRID_CACHE_SIZE = 4
+
+
+# frequency axis of an n point fft of a record sampled at fs, cached and read-only. the default is the grid used by the
+# complex carrier_filter and velocity_calculation passes, fftshift(arange(-n/2, n/2)) * fs / n (which is offset by half
+# a bin for odd n); real=True gives the one-sided rfft grid
+@lru_cache(maxsize=FFT_GRID_CACHE_SIZE)
+def fft_frequencies(n, fs, real=False):
+    if real:
+        freq = rfftfreq(n, 1 / fs)
+    else:
+        freq = fftshift(np.arange(-n / 2, n / 2) * fs / n)
+    freq.flags.writeable = False
+    return freq
+
+
+# use the real-input (rfft/irfft) path for the full record transforms of carrier_filter and velocity_calculation,
+# set with the 'real_fft' input
+def use_real_fft(**inputs):
+    return bool(inputs.get("real_fft", False))
+
+
+# complex signal of a length n record whose spectrum is the given one-sided (rfft) spectrum at the positive frequencies
+# and zero at the negative ones. for a band-passed spectrum that excludes dc and nyquist this is half the analytic signal
+# of the band, the same as the inverse fft of the full spectrum masked to the positive band
+def analytic_from_rfft(spectrum, n, workers=None):
+    full = np.zeros(n, dtype=complex)
+    full[: len(spectrum)] = spectrum
+    return ifft(full, workers=workers)
+
+
+# transform length of an n sample record under the 'fft_padding' input. 'none' (the default) keeps n. 'pad' zero pads to
+# the next fast length (scipy.fft.next_fast_len) and the filtering passes crop their output back to n samples. 'trim'
+# pads the filtering passes too, since their output has to cover every sample, but spectrum estimates (trim=True) are
+# taken over the largest fast length at or below n, leaving out the last samples of their window
+def fft_length(n, real=False, trim=False, **inputs):
+    policy = inputs.get("fft_padding", "none")
+    if policy not in ("none", "pad", "trim"):
+        raise ValueError(f"fft_padding must be 'none', 'pad' or 'trim', not {policy!r}")
+    if policy == "none" or n < 1:
+        return n
+    if policy == "trim" and trim:
+        return previous_fast_len(n, real)
+    return next_fast_len(n, real)
+
+
+# largest length at or below n that next_fast_len considers fast (5-smooth for real transforms, 11-smooth otherwise)
+@lru_cache(maxsize=FFT_GRID_CACHE_SIZE)
+def previous_fast_len(n, real=False):
+    while next_fast_len(n, real) != n:
+        n -= 1
+    return n
+
+
+# number of stft plans (and legacy crop indices) kept between calls. a run uses one or two plans, so this only
+# matters for sweeps and batches that vary the stft parameters
+STFT_PLAN_CACHE_SIZE = 32
+
+
+# windows are given as a name or a (name, parameter) tuple. lists (e.g. from json input files) are made hashable
+def _window_key(window):
+    return tuple(window) if isinstance(window, list) else window
+
+
+@lru_cache(maxsize=STFT_PLAN_CACHE_SIZE)
+def _stft_plan(window, fs, nperseg, noverlap, nfft):
+    return ShortTimeFFT.from_window(
+        window,
+        fs=fs,
+        nperseg=nperseg,
+        noverlap=noverlap,
+        mfft=nfft,
+        scale_to="magnitude",
+        phase_shift=None,
+    )
+
+
+# ShortTimeFFT plan for the stft inputs, reused across calls with the same window, nperseg, noverlap, nfft and fs
+def stft_plan(fs, **inputs):
+    return _stft_plan(
+        _window_key(inputs["window"]), float(fs), int(inputs["nperseg"]), int(inputs["noverlap"]), int(inputs["nfft"])
+    )
+
+
+@lru_cache(maxsize=STFT_PLAN_CACHE_SIZE)
+def _legacy_crop(window, fs, nperseg, noverlap, nfft, n):
+    SFT = _stft_plan(window, fs, nperseg, noverlap, nfft)
+    t_full = SFT.t(n)
+
+    # calculate the time array for the legacy scipy stft function without zero padding on the boundaries
+    t_legacy = np.arange(nperseg / 2, n - nperseg / 2 + 1, nperseg - noverlap) / float(fs)
+
+    # find the time index in the new stft function that corresponds to where the legacy function time array begins
+    t_idx = int(np.argmin(np.abs(t_full - t_legacy[0])))
+
+    # crop the time array to the length of the legacy function
+    t_crop = t_full[t_idx : t_idx + len(t_legacy)]
+    t_crop.flags.writeable = False
+    return t_idx, t_crop
+
+
+# first frame and (read-only) time array of the legacy stft output within the zero padded ShortTimeFFT output for a
+# signal of n samples
+def legacy_crop(n, fs, **inputs):
+    return _legacy_crop(
+        _window_key(inputs["window"]),
+        float(fs),
+        int(inputs["nperseg"]),
+        int(inputs["noverlap"]),
+        int(inputs["nfft"]),
+        int(n),
+    )
+
+
+# bins of the one-sided stft frequency grid closest to freq_min and freq_max. these are the same indices the callers
+# find with argmin on the full grid, so a band limited stft returns bins freq_min_idx through freq_max_idx inclusive
+def band_bins(fs, **inputs):
+    f = stft_plan(fs, **inputs).f
+    return int(np.argmin(np.abs(f - inputs["freq_min"]))), int(np.argmin(np.abs(f - inputs["freq_max"])))
+
+
+# chirp-z transform evaluating the nfft point dft of an nperseg sample segment at bins kmin..kmax only
+@lru_cache(maxsize=STFT_PLAN_CACHE_SIZE)
+def _band_czt(nperseg, nfft, kmin, kmax):
+    return CZT(nperseg, m=kmax - kmin + 1, w=np.exp(-2j * np.pi / nfft), a=np.exp(2j * np.pi * kmin / nfft))
+
+
+# samples of the legacy stft frames j0..j1 as an (frames, nperseg) strided view. the padded output starts at frame
+# p_min (< 0), so legacy frame j is frame p = p_min + t_idx + j, covering samples p * hop - m_num_mid up to m_num
+# samples later. zero pad where the first or last frame runs past the ends of the signal, as the ShortTimeFFT 'zeros'
+# padding does
+def _legacy_frames(voltage, SFT, t_idx, j0, j1):
+    p0 = SFT.p_min + t_idx + j0
+    start = p0 * SFT.hop - SFT.m_num_mid
+    stop = (p0 + j1 - j0 - 1) * SFT.hop - SFT.m_num_mid + SFT.m_num
+    pad = (max(0, -start), max(0, stop - voltage.shape[-1]))
+    x = np.pad(voltage, pad) if any(pad) else voltage
+    return np.lib.stride_tricks.sliding_window_view(x[start + pad[0] : stop + pad[0]], SFT.m_num)[:: SFT.hop]
+
+
+# band limited version of stft. the windowed segments of the legacy frames are transformed with a chirp-z transform
+# that only produces the bins between freq_min and freq_max, instead of computing all nfft / 2 + 1 bins and slicing
+def band_stft(voltage, fs, frames=None, **inputs):
+    SFT = stft_plan(fs, **inputs)
+    t_idx, t_legacy = legacy_crop(voltage.shape[-1], fs, **inputs)
+    kmin, kmax = band_bins(fs, **inputs)
+    j0, j1 = frames or (0, len(t_legacy))
+    segments = _legacy_frames(voltage, SFT, t_idx, j0, j1)
+
+    # transform the windowed segments (scaled to magnitude by the plan) and put frequency on the first axis
+    with set_workers(fft_workers(**inputs)):
+        Sx_band = _band_czt(SFT.m_num, SFT.mfft, kmin, kmax)(segments * SFT.win, axis=-1).T
+
+    return SFT.f[kmin : kmax + 1], t_legacy[j0:j1].copy(), Sx_band
+
+
+# most terms a window may have in its own dft for stft_bin to use the sliding dft (a hann window has 3)
+SLIDING_DFT_MAX_TERMS = 8
+
+
+# the stft window of m samples as a sum of complex exponentials, win[i] = sum(weights * exp(2j pi lags i / m)), with
+# only the non-negligible terms kept. cosine-sum windows (boxcar, hann, hamming, blackman) have 1 to 5 terms
+def _window_terms(win):
+    m = len(win)
+    spectrum = fft(win) / m
+    lags = np.flatnonzero(np.abs(spectrum) > 1e-12 * np.abs(spectrum).max())
+    return np.where(lags > m // 2, lags - m, lags), spectrum[lags]
+
+
+# sliding dft of stft bin k over every legacy frame. for a rectangular frame of m samples starting at s, the dft
+# coefficient at frequency nu (cycles per sample) obeys S[s + 1] = (S[s] - x[s] + x[s + m] exp(-2j pi nu m)) exp(2j pi nu)
+# and this recursion is evaluated in its integrator-comb form: a running sum of the mixed samples x[n] exp(-2j pi nu n)
+# and the difference of two of its values per frame. a window term exp(2j pi l i / m) shifts the frequency by -l / m,
+# so the windowed coefficient is the weighted sum of one sliding dft per window term, O(len(voltage)) each. phases are
+# looked up from tables indexed by (k n) mod nfft and (l n) mod m, so they stay exact over long records
+def _sliding_dft(voltage, SFT, t_idx, frames, k, lags, weights):
+    m = SFT.m_num
+    start = (SFT.p_min + t_idx) * SFT.hop - SFT.m_num_mid
+    starts = SFT.hop * np.arange(frames)
+    stop = start + starts[-1] + m
+    pad = (max(0, -start), max(0, stop - voltage.shape[-1]))
+    x = np.pad(voltage, pad) if any(pad) else voltage
+    x = x[start + pad[0] : stop + pad[0]]
+
+    # the phase tables repeat every nfft / gcd(k, nfft) and m samples, so they are tiled instead of evaluated
+    period = SFT.mfft // np.gcd(k, SFT.mfft)
+    carrier = np.exp(-2j * np.pi * ((k * np.arange(period)) % SFT.mfft) / SFT.mfft)
+    mixed = x * np.resize(carrier, len(x))
+    shifted = np.empty_like(mixed)
+    running = np.zeros(len(x) + 1, dtype=complex)
+    values = np.zeros(frames, dtype=complex)
+    for lag, weight in zip(lags, weights):
+        shift = np.exp(2j * np.pi * ((lag * np.arange(m)) % m) / m)
+        np.multiply(mixed, np.resize(shift, len(x)), out=shifted)
+        np.cumsum(shifted, out=running[1:])
+        phase = carrier[starts % period] * shift[starts % m]
+        values += weight * np.conj(phase) * (running[starts + m] - running[starts])
+    return values
+
+
+# single frequency row of the stft, at the bin closest to freq, evaluated straight from the samples with a sliding
+# dft (_sliding_dft), in O(len(voltage)) per window term and with no spectrogram. windows that are not a short sum of
+# cosines fall back to one windowed dft coefficient per frame, O(len(voltage) * nperseg / hop). returns the bin
+# frequency, the legacy frame times and the complex values, equal to f[k], t and Zxx[k] from stft
+def stft_bin(voltage, fs, freq, **inputs):
+    SFT = stft_plan(fs, **inputs)
+    t_idx, t_legacy = legacy_crop(voltage.shape[-1], fs, **inputs)
+    f = SFT.f
+    k = int(np.argmin(np.abs(f - freq)))
+
+    lags, weights = _window_terms(SFT.win)
+    if len(lags) <= SLIDING_DFT_MAX_TERMS:
+        values = _sliding_dft(voltage, SFT, t_idx, len(t_legacy), k, lags, weights)
+    else:
+        kernel = SFT.win * np.exp(-2j * np.pi * k * np.arange(SFT.m_num) / SFT.mfft)
+        values = _legacy_frames(voltage, SFT, t_idx, 0, len(t_legacy)) @ kernel
+
+    return f[k], t_legacy.copy(), values
+
+
+# frequency and time arrays of the stft of a signal of n samples (over the optional frames range), without
+# calculating it
+def stft_grid(n, fs, frames=None, **inputs):
+    f = stft_plan(fs, **inputs).f
+    if inputs.get("stft_band_limited", False):
+        kmin, kmax = band_bins(fs, **inputs)
+        f = f[kmin : kmax + 1]
+    t_legacy = legacy_crop(n, fs, **inputs)[1]
+    j0, j1 = frames or (0, len(t_legacy))
+    return f, t_legacy[j0:j1].copy()
+
+
+# function to calculate the short time fourier transform (stft) of a signal. ALPSS was originally built with a scipy
+# STFT function that may now be deprecated in the future. This function seeks to roughly replicate the behavior of the
+# legacy stft function, specifically how the time windows are calculated and how the boundaries are handled. frames
+# is an optional (start, stop) range of the legacy time frames to calculate, by default all of them
+def stft(voltage, fs, frames=None, **inputs):
+    # only compute the bins between freq_min and freq_max
+    if inputs.get("stft_band_limited", False):
+        return band_stft(voltage, fs, frames=frames, **inputs)
+
+    # start index and time array of the legacy scipy stft function (without zero padding on the boundaries) within
+    # the zero padded output of the new scipy library function. copied so callers can modify the returned time array
+    # without touching the cached one
+    SFT = stft_plan(fs, **inputs)
+    t_idx, t_legacy = legacy_crop(voltage.shape[-1], fs, **inputs)
+    j0, j1 = frames or (0, len(t_legacy))
+    t_crop = t_legacy[j0:j1].copy()
+    f = SFT.f
+
+    # calculate only the frames on the legacy time grid. the padded output starts at frame p_min, so the legacy frames
+    # are p_min + t_idx onwards
+    p0 = SFT.p_min + t_idx + j0
+    with set_workers(fft_workers(**inputs)):
+        Sx_crop = SFT.stft(voltage, p0=p0, p1=p0 + j1 - j0, padding="zeros")
+
+    # return the frequency, time, and magnitude arrays
+    return f, t_crop, Sx_crop
+
+
@@ -1,11 +1,33 @@
-from scipy.signal import ShortTimeFFT
 import numpy as np
 import io
+import os
 import pandas as pd
 import logging
+from alpss.io.binary import RAW_DTYPES, open_binary, binary_window
+from alpss.io.csv_index import DEFAULT_STRIDE, read_csv_window
+from alpss.io.scope import SCOPE_FORMATS, ScopeTrace, read_scope, read_trc, read_isf, read_wfm
+from alpss.io.cache import cached_columns
+from alpss.spectral import stft
 logger = logging.getLogger("alpss")
 
 
+# work out how the input trace is stored. 'data_format' can be given explicitly, otherwise it is taken from the file
+# extension and anything unrecognized is treated as csv
+def data_format(inputs):
+    fmt = inputs.get("data_format", "auto")
+    if fmt != "auto":
+        return fmt
+
+    ext = os.path.splitext(str(inputs.get("filepath", "")))[1].lower()
+    if ext == ".npy":
+        return "npy"
+    if ext in RAW_DTYPES:
+        return "raw"
+    if ext in SCOPE_FORMATS:
+        return SCOPE_FORMATS[ext]
+    return "csv"
+
+
 def extract_data(inputs):
     # Calculate the time interval between samples
     t_step = 1 / inputs["sample_rate"]
@@ -23,12 +45,65 @@ def extract_data(inputs):
     # Get the file path from the inputs
     fname = inputs["filepath"]
 
+    # With a synthesized time axis only the amplitude column is read; time is rebuilt from the sample rate
+    amplitude_only = inputs.get("time_axis", "column") == "synthesized"
+    usecols = [1] if amplitude_only else None
+
+    # Binary traces are memory-mapped and only the requested window is sliced out. The csv reader below consumes the
+    # first unskipped line as column names, so the first sample it returns sits one row past the skipped rows; the
+    # binary window starts at that same sample so a trace converted from csv reproduces the csv results exactly
+    fmt = data_format(inputs)
+    if fmt != "csv":
+        source = inputs["bytestring"] if isinstance(inputs.get("bytestring"), bytes) else fname
+        if not isinstance(source, (bytes, str)):
+            raise TypeError(f"Unsupported input type, which must be 'bytestring' or 'filepath': {type(fname)}")
+        first = int(rows_to_skip) + 1 - inputs["header_lines"]
+
+        # native oscilloscope files are decoded straight from their headers (gain, offset, dt)
+        if fmt in SCOPE_FORMATS.values():
+            trace = read_scope(fmt, source)
+            if not np.isclose(1 / trace.dt, inputs["sample_rate"], rtol=1e-3):
+                logger.warning(
+                    "Sample rate in the %s header (%g) differs from 'sample_rate' (%g)",
+                    fmt, 1 / trace.dt, inputs["sample_rate"],
+                )
+            voltage = trace.voltage(first, first + int(nrows))
+            if amplitude_only:
+                return pd.DataFrame({"Ampl": voltage})
+            time = trace.t0 + (first + np.arange(voltage.shape[0])) * trace.dt
+        else:
+            samples = open_binary(fmt, source, **inputs)
+            time, voltage = binary_window(samples, first, int(nrows), inputs["sample_rate"], with_time=not amplitude_only)
+        return pd.DataFrame({"Ampl": voltage} if amplitude_only else {"Time": time, "Ampl": voltage})
+
+    # With the trace cache enabled the csv is parsed in full once, keyed by its content hash, and every later call
+    # slices its window out of the memory-mapped columns
+    if inputs.get("trace_cache", False):
+        source = inputs["bytestring"] if isinstance(inputs.get("bytestring"), bytes) else fname
+        if not isinstance(source, (bytes, str)):
+            raise TypeError(f"Unsupported input type, which must be 'bytestring' or 'filepath': {type(fname)}")
+        samples = cached_columns(source, **inputs)
+        if samples is not None:
+            first = int(rows_to_skip) + 1 - inputs["header_lines"]
+            time, voltage = binary_window(samples, first, int(nrows), inputs["sample_rate"], with_time=not amplitude_only)
+            return pd.DataFrame({"Ampl": voltage} if amplitude_only else {"Time": time, "Ampl": voltage})
+
     # If the data is provided as a byte string (e.g., uploaded in memory)
     if "bytestring" in inputs and isinstance(inputs["bytestring"], bytes):
         data = pd.read_csv(
             io.BytesIO(inputs["bytestring"]),  # Read from the byte string as a file
             skiprows=int(rows_to_skip),        # Skip calculated number of rows
             nrows=int(nrows),                  # Read only the desired number of rows
+            usecols=usecols,                   # Read only the amplitude column if time is synthesized
+        )
+    # If a file path is provided as a string and a sidecar line index is wanted, seek straight to the first row
+    elif isinstance(fname, str) and inputs.get("csv_index", False):
+        data = read_csv_window(
+            fname,
+            int(rows_to_skip),
+            int(nrows),
+            stride=inputs.get("csv_index_stride", DEFAULT_STRIDE),
+            usecols=usecols,
         )
     # If a file path is provided as a string
     elif isinstance(fname, str):
@@ -36,6 +111,7 @@ def extract_data(inputs):
             fname,                             # Read from file path
             skiprows=int(rows_to_skip),        # Skip calculated number of rows
             nrows=int(nrows),                  # Read only the desired number of rows
+            usecols=usecols,                   # Read only the amplitude column if time is synthesized
         )
     # If input type is not supported, raise an error
     else:
@@ -44,41 +120,59 @@ def extract_data(inputs):
     return data
 
 
-# function to calculate the short time fourier transform (stft) of a signal. ALPSS was originally built with a scipy
-# STFT function that may now be deprecated in the future. This function seeks to roughly replicate the behavior of the
-# legacy stft function, specifically how the time windows are calculated and how the boundaries are handled
-def stft(voltage, fs, **inputs):
-    # calculate stft with the new scipy library function and zero padding the boundaries
-    SFT = ShortTimeFFT.from_window(
-        inputs["window"],
-        fs=fs,
-        nperseg=inputs["nperseg"],
-        noverlap=inputs["noverlap"],
-        mfft=inputs["nfft"],
-        scale_to="magnitude",
-        phase_shift=None,
-    )
-    Sx_full = SFT.stft(voltage, padding="zeros")
-    t_full = SFT.t(len(voltage))
-    f = SFT.f
-
-    # calculate the time array for the legacy scipy stft function without zero padding on the boundaries
-    t_legacy = np.arange(
-        inputs["nperseg"] / 2,
-        voltage.shape[-1] - inputs["nperseg"] / 2 + 1,
-        inputs["nperseg"] - inputs["noverlap"],
-    ) / float(fs)
-
-    # find the time index in the new stft function that corresponds to where the legacy function time array begins
-    t_idx = np.argmin(np.abs(t_full - t_legacy[0]))
-
-    # crop the time array to the length of the legacy function
-    t_crop = t_full[t_idx : t_idx + len(t_legacy)]
-
-    # crop the stft magnitude array to the length of the legacy function
-    Sx_crop = Sx_full[:, t_idx : t_idx + len(t_legacy)]
-
-    # return the frequency, time, and magnitude arrays
-    return f, t_crop, Sx_crop
+class TimeAxis(np.lib.mixins.NDArrayOperatorsMixin):
+    """Uniformly sampled time axis ``t0 + i * dt`` for ``i`` in ``range(n)``.
+
+    Stands in for the time column of uniformly sampled scope data without holding a full
+    length array. Integer indexing returns a float and slicing materializes only the slice;
+    arithmetic, comparisons and numpy functions materialize the full array on demand (e.g.
+    for plotting and saving).
+    """
+
+    def __init__(self, t0, dt, n):
+        self.t0 = float(t0)
+        self.dt = float(dt)
+        self.n = int(n)
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def shape(self):
+        return (self.n,)
+
+    @property
+    def size(self):
+        return self.n
+
+    @property
+    def ndim(self):
+        return 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.t0 + np.arange(*key.indices(self.n)) * self.dt
+        if isinstance(key, (int, np.integer)):
+            idx = int(key) + self.n if key < 0 else int(key)
+            if not 0 <= idx < self.n:
+                raise IndexError(f"index {key} is out of bounds for a time axis of length {self.n}")
+            return self.t0 + idx * self.dt
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        return (self.t0 + np.arange(self.n) * self.dt).astype(dtype or np.float64, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *args, **kwargs):
+        args = [np.asarray(a) if isinstance(a, TimeAxis) else a for a in args]
+        return getattr(ufunc, method)(*args, **kwargs)
+
+    def index(self, t):
+        """Index of the sample closest in time to ``t``."""
+        return int(np.clip(np.round((t - self.t0) / self.dt), 0, self.n - 1))
 
 
+# index of the sample in a time array (or TimeAxis) closest to the time t
+def nearest_index(time, t):
+    if isinstance(time, TimeAxis):
+        return time.index(t)
+    return np.argmin(np.abs(time - t))
@@ -1,8 +1,14 @@
 from scipy.fft import fft
 from scipy.fft import ifft
-from scipy.fftpack import fftshift
+from scipy.fft import rfft
 from alpss.velocity.derivative import *
 from alpss.velocity.smoothing import *
+from alpss.utils import nearest_index
+from alpss.spectral import fft_workers, fft_frequencies, fft_length, use_real_fft, analytic_from_rfft
+
+
+# default guard band of the 'roi' velocity window, on either side of the samples that are kept
+VELOCITY_GUARD_TIME = 50e-9
 
 
 # function to calculate the velocity from the filtered voltage signal
@@ -13,21 +19,41 @@ def velocity_calculation(
     fs = spall_doi_finder_outputs["fs"]
     time = spall_doi_finder_outputs["time"]
     voltage_filt = carrier_filter_outputs["voltage_filt"]
-    freq_min = inputs["freq_min"]
-    freq_max = inputs["freq_max"]
     lam = inputs["lam"]
     t_doi_start = spall_doi_finder_outputs["t_doi_start"]
     t_doi_end = spall_doi_finder_outputs["t_doi_end"]
 
-    # isolate signal. filter out all frequencies that are outside the range of interest
-    numpts = len(time)
-    freq = fftshift(np.arange((-numpts / 2), (numpts / 2)) * fs / numpts)
-    filt = (freq > freq_min) * (freq < freq_max)
-    voltage_filt = ifft(fft(voltage_filt) * filt)
-
     # get the indices in the time array closest to the domain start and end times
-    time_start_idx = np.argmin(np.abs(time - t_doi_start))
-    time_end_idx = np.argmin(np.abs(time - t_doi_end))
+    time_start_idx = nearest_index(time, t_doi_start)
+    time_end_idx = nearest_index(time, t_doi_end)
+
+    # isolate signal. filter out all frequencies that are outside the range of interest. by default this is done over
+    # the whole record; 'velocity_window': 'roi' only builds the samples the derivative and smoothing use, and the
+    # carrier band instantaneous_uncertainty_analysis fits the noise on. voltage_filt then starts at voltage_filt_offset.
+    # the fused spectral stage of carrier_filter has already band passed the whole record
+    numpts = len(time)
+    voltage_analytic = carrier_filter_outputs.get("voltage_analytic")
+    velocity_window = inputs.get("velocity_window", "full")
+    voltage_filt_early = None
+    if velocity_window == "roi":
+        pad = int(np.floor(inputs["smoothing_window"] / 2)) + 4
+        offset = max(0, time_start_idx - pad)
+        stop = min(numpts, time_end_idx + pad)
+        steps_take = int(inputs["carrier_band_time"] * fs)
+        if voltage_analytic is not None:
+            voltage_filt_early = voltage_analytic[:steps_take]
+            voltage_filt = voltage_analytic[offset:stop]
+        else:
+            voltage_filt_early = band_pass_window(voltage_filt, fs, 0, steps_take, **inputs)
+            voltage_filt = band_pass_window(voltage_filt, fs, offset, stop, **inputs)
+    elif velocity_window == "full":
+        offset = 0
+        if voltage_analytic is not None:
+            voltage_filt = voltage_analytic
+        else:
+            voltage_filt = band_pass(voltage_filt, fs, **inputs)
+    else:
+        raise ValueError(f"velocity_window must be 'full' or 'roi', not {velocity_window!r}")
 
     # unwrap the phase angle of the filtered voltage signal
     phas = np.unwrap(np.angle(voltage_filt), axis=0)
@@ -35,7 +61,7 @@ def velocity_calculation(
     # take the numerical derivative using the certral difference method with a 9-point stencil
     # return the derivative on the domain of interest (dpdt) as well as the padded derivative to be used for smoothing
     dpdt, dpdt_pad = num_derivative(
-        phas, inputs["smoothing_window"], time_start_idx, time_end_idx, fs
+        phas, inputs["smoothing_window"], time_start_idx - offset, time_end_idx - offset, fs
     )
 
     # convert the derivative in to velocity
@@ -64,6 +90,56 @@ def velocity_calculation(
         "voltage_filt": voltage_filt,
         "time_start_idx": time_start_idx,
         "time_end_idx": time_end_idx,
+        "voltage_filt_offset": offset,
     }
 
+    # the band passed carrier band, outside the window of voltage_filt
+    if voltage_filt_early is not None:
+        vc_out["voltage_filt_early"] = voltage_filt_early
+
     return vc_out
+
+
+# band pass the filtered voltage to the positive frequencies between freq_min and freq_max, giving the complex signal
+# whose phase is unwrapped. under an 'fft_padding' policy the record is zero padded to a fast length and the result
+# cropped back
+def band_pass(voltage_filt, fs, **inputs):
+    numpts = len(voltage_filt)
+    freq_min = inputs["freq_min"]
+    freq_max = inputs["freq_max"]
+    workers = fft_workers(**inputs)
+    if use_real_fft(**inputs):
+        # the filtered voltage is real, so the positive band is taken from its one-sided spectrum
+        n_fft = fft_length(numpts, real=True, **inputs)
+        freq = fft_frequencies(n_fft, fs, real=True)
+        filt = (freq > freq_min) * (freq < freq_max)
+        return analytic_from_rfft(
+            rfft(np.real(voltage_filt), n=n_fft, workers=workers) * filt, n_fft, workers=workers
+        )[:numpts]
+    n_fft = fft_length(numpts, **inputs)
+    freq = fft_frequencies(n_fft, fs)
+    filt = (freq > freq_min) * (freq < freq_max)
+    return ifft(fft(voltage_filt, n=n_fft, workers=workers) * filt, workers=workers)[:numpts]
+
+
+# band_pass of samples start:stop of the filtered voltage only. the window is transformed together with up to
+# velocity_guard_time of the record on either side, which is tapered to zero with a half cosine so that the circular
+# wrap-around of the short transform does not ring into the window, and then dropped
+def band_pass_window(voltage_filt, fs, start, stop, **inputs):
+    guard = int(round(inputs.get("velocity_guard_time", VELOCITY_GUARD_TIME) * fs))
+    first = max(0, start - guard)
+    last = min(len(voltage_filt), stop + guard)
+    segment = np.array(voltage_filt[first:last])
+    lead = start - first
+    trail = last - stop
+    if lead > 0:
+        segment[:lead] *= 0.5 - 0.5 * np.cos(np.pi * np.arange(lead) / lead)
+    if trail > 0:
+        segment[len(segment) - trail :] *= 0.5 + 0.5 * np.cos(np.pi * np.arange(1, trail + 1) / trail)
+    return band_pass(segment, fs, **inputs)[lead : lead + stop - start]
+
+
+# time of each sample of vc_out["voltage_filt"], which starts voltage_filt_offset samples into the record
+def voltage_filt_time(sdf_out, vc_out):
+    offset = vc_out.get("voltage_filt_offset", 0)
+    return sdf_out["time"][offset:offset + len(vc_out["voltage_filt"])]
@@ -0,0 +1,263 @@
+import pytest
+import numpy as np
+from scipy.fft import fft, fftfreq
+from scipy.optimize import curve_fit
+from alpss.carrier.filter import carrier_filter
+from alpss.carrier.frequency import carrier_frequency
+from alpss.carrier.sine_fit import sine_fit_linear
+from alpss.velocity.calculation import velocity_calculation
+from alpss.analysis.instantaneous_uncertainty import instantaneous_uncertainty_analysis
+from alpss.spectral import peak_offset
+from alpss.utils import TimeAxis, extract_data
+from alpss.detection.spall_doi_finder import spall_doi_finder
+
+
+@pytest.fixture
+def sdf_out():
+    # a 2.2 GHz carrier that ramps up in frequency after 300 ns
+    fs = 80e9
+    time = np.arange(60000) / fs
+    t_start = 300e-9
+    ramp = np.where(time > t_start, 0.5e9 * (time - t_start) / 100e-9, 0.0)
+    phase = 2 * np.pi * np.cumsum(2.2e9 + ramp) / fs
+    voltage = np.sin(phase) + 0.01 * np.random.default_rng(0).standard_normal(len(time))
+    return {
+        "time": time,
+        "voltage": voltage,
+        "fs": fs,
+        "t_start_corrected": t_start,
+        "t_doi_start": t_start - 5e-9,
+        "t_doi_end": t_start + 200e-9,
+    }
+
+
+@pytest.mark.parametrize("carrier_filter_type", ["gaussian_notch", "none"])
+def test_roi_filtered_spectrogram_matches_full(valid_inputs, sdf_out, carrier_filter_type):
+    inputs = {**valid_inputs, "carrier_filter_type": carrier_filter_type}
+
+    full = carrier_filter(sdf_out, 2.2e9, **inputs, filtered_spectrogram="full")
+    roi = carrier_filter(sdf_out, 2.2e9, **inputs)
+
+    np.testing.assert_array_equal(roi["Zxx_filt_doi"], full["Zxx_filt_doi"])
+    np.testing.assert_array_equal(roi["power_filt_doi"], full["power_filt_doi"])
+
+    # only the frames around the domain of interest are calculated
+    assert roi["Zxx_filt"].shape[1] < full["Zxx_filt"].shape[1]
+    assert roi["t_filt"][0] <= sdf_out["t_doi_start"] and roi["t_filt"][-1] >= sdf_out["t_doi_end"]
+    first = np.flatnonzero(full["t_filt"] == roi["t_filt"][0])[0]
+    np.testing.assert_array_equal(roi["Zxx_filt"], full["Zxx_filt"][:, first : first + len(roi["t_filt"])])
+
+
+@pytest.mark.parametrize("method, tol", [("parabolic", 0.25), ("gaussian", 0.2), ("jacobsen", 0.01)])
+def test_peak_offset(method, tol):
+    n = 1000
+    rng = np.random.default_rng(5)
+    for true_bin in rng.uniform(100.5, 101.5, 20):
+        spectrum = fft(np.cos(2 * np.pi * true_bin * np.arange(n) / n + rng.uniform(0, 2 * np.pi)))
+        k = np.argmax(np.abs(spectrum[: n // 2]))
+        assert abs(k + peak_offset(spectrum, k, method) - true_bin) < tol
+
+    # columns of a 2-D spectrum, with peaks on the edge bins left alone
+    spectra = fft(np.cos(2 * np.pi * np.outer(np.arange(n), [100.3, 0.0, 200.7]) / n), axis=0)
+    offsets = peak_offset(spectra, np.array([100, 0, 201]), method)
+    assert offsets[1] == 0.0
+    assert offsets[0] > 0 and offsets[2] < 0
+
+    with pytest.raises(ValueError):
+        peak_offset(spectrum, 100, "quadratic")
+
+
+def test_interpolated_carrier_frequency(valid_inputs, sdf_out):
+    # the 2.2 GHz carrier of the fixture falls between the fft bins of a 251.3 ns carrier band
+    inputs = {**valid_inputs, "carrier_band_time": 251.3e-9}
+    cen = carrier_frequency(sdf_out, **inputs)
+    cen_interp = carrier_frequency(sdf_out, **inputs, peak_interpolation="jacobsen")
+    assert abs(cen_interp - 2.2e9) < abs(cen - 2.2e9)
+    assert abs(cen_interp - 2.2e9) < 0.1e6
+
+
+@pytest.mark.parametrize("carrier_filter_type", ["gaussian_notch", "sin_fit_subtract", "none"])
+def test_real_fft_path_matches_complex(valid_inputs, sdf_out, carrier_filter_type):
+    inputs = {**valid_inputs, "carrier_filter_type": carrier_filter_type, "t_fit_begin": -250e-9, "t_fit_end": -20e-9}
+
+    cf_out = carrier_filter(sdf_out, 2.2e9, **inputs)
+    cf_out_real = carrier_filter(sdf_out, 2.2e9, **inputs, real_fft=True)
+    assert np.isrealobj(cf_out_real["voltage_filt"])
+    np.testing.assert_allclose(cf_out_real["voltage_filt"], np.real(cf_out["voltage_filt"]), rtol=0, atol=1e-9)
+
+    vc_out = velocity_calculation(sdf_out, 2.2e9, cf_out, **inputs)
+    vc_out_real = velocity_calculation(sdf_out, 2.2e9, cf_out_real, **inputs, real_fft=True)
+    np.testing.assert_allclose(vc_out_real["voltage_filt"], vc_out["voltage_filt"], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(vc_out_real["velocity_f"], vc_out["velocity_f"], rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize("carrier_filter_type", ["gaussian_notch", "none"])
+def test_fused_spectral_stage_matches_two_stage_chain(valid_inputs, sdf_out, carrier_filter_type):
+    inputs = {**valid_inputs, "carrier_filter_type": carrier_filter_type}
+
+    vc_out = velocity_calculation(sdf_out, 2.2e9, carrier_filter(sdf_out, 2.2e9, **inputs), **inputs)
+    cf_out_fused = carrier_filter(sdf_out, 2.2e9, **inputs, fused_spectral_stage=True)
+    vc_out_fused = velocity_calculation(sdf_out, 2.2e9, cf_out_fused, **inputs)
+    np.testing.assert_array_equal(vc_out_fused["voltage_filt"], cf_out_fused["voltage_analytic"])
+
+    # the stages differ in the edge transient of the notch at the signal start. the doppler signal starts at the carrier
+    # and stays inside the notch for about 20 ns, after which they agree
+    np.testing.assert_allclose(vc_out_fused["velocity_f_smooth"], vc_out["velocity_f_smooth"], rtol=0, atol=40)
+    later = vc_out["time_f"] > sdf_out["t_start_corrected"] + 40e-9
+    np.testing.assert_allclose(
+        vc_out_fused["velocity_f_smooth"][later], vc_out["velocity_f_smooth"][later], rtol=0, atol=0.1
+    )
+    if carrier_filter_type == "none":
+        np.testing.assert_array_equal(cf_out_fused["voltage_filt"], sdf_out["voltage"])
+        np.testing.assert_array_equal(vc_out_fused["velocity_f_smooth"], vc_out["velocity_f_smooth"])
+
+    # before the signal start the carrier is kept
+    early = slice(2000, int(0.8 * sdf_out["t_start_corrected"] * sdf_out["fs"]))
+    np.testing.assert_allclose(vc_out_fused["voltage_filt"][early], vc_out["voltage_filt"][early], rtol=0, atol=2e-3)
+
+
+@pytest.fixture
+def example_sdf_out(valid_inputs):
+    # start time detection on the example file
+    return spall_doi_finder(extract_data(valid_inputs), **valid_inputs)
+
+
+def test_fused_spectral_stage_on_example_file(valid_inputs, example_sdf_out):
+    sdf_out = example_sdf_out
+    cen = carrier_frequency(sdf_out, **valid_inputs)
+    vc_out = velocity_calculation(sdf_out, cen, carrier_filter(sdf_out, cen, **valid_inputs), **valid_inputs)
+    cf_out_fused = carrier_filter(sdf_out, cen, **valid_inputs, fused_spectral_stage=True)
+    vc_out_fused = velocity_calculation(sdf_out, cen, cf_out_fused, **valid_inputs)
+
+    # the whole domain of interest, including the notch's edge transient in the first 10 ns after the signal start
+    # (the raw velocity there is up to about 2.8 km/s apart)
+    np.testing.assert_allclose(vc_out_fused["velocity_f_smooth"], vc_out["velocity_f_smooth"], rtol=0, atol=15)
+    later = vc_out["time_f"] > sdf_out["t_start_corrected"] + 10e-9
+    np.testing.assert_allclose(
+        vc_out_fused["velocity_f_smooth"][later], vc_out["velocity_f_smooth"][later], rtol=0, atol=0.05
+    )
+
+
+@pytest.mark.parametrize(
+    "carrier_filter_type, fused",
+    [("gaussian_notch", False), ("gaussian_notch", True), ("sin_fit_subtract", False), ("none", False)],
+)
+def test_fft_padding_matches_unpadded(valid_inputs, sdf_out, carrier_filter_type, fused):
+    # 59999 samples has no prime factor below 300, so the padded transforms are 60000 points. the real transforms are
+    # used because the legacy complex notch grid is offset by half a bin for the odd unpadded length
+    sdf_out = {**sdf_out, "time": sdf_out["time"][:59999], "voltage": sdf_out["voltage"][:59999]}
+    inputs = {
+        **valid_inputs,
+        "carrier_filter_type": carrier_filter_type,
+        "t_fit_begin": -250e-9,
+        "t_fit_end": -20e-9,
+        "real_fft": True,
+        "fused_spectral_stage": fused,
+    }
+
+    # padding changes the circular wrap-around, which is largest at the ends of the record and, for the notch segment,
+    # at the signal start
+    cf_out = carrier_filter(sdf_out, 2.2e9, **inputs)
+    cf_out_pad = carrier_filter(sdf_out, 2.2e9, **inputs, fft_padding="pad")
+    assert cf_out_pad["voltage_filt"].shape == (59999,)
+    np.testing.assert_allclose(
+        cf_out_pad["voltage_filt"][2000:-2000], cf_out["voltage_filt"][2000:-2000], rtol=0, atol=1e-2
+    )
+
+    # the sine fit of the fixture's carrier is subtracted after the signal start too, so the filtered signal passes
+    # through zero and its phase is too fragile to compare
+    if carrier_filter_type != "sin_fit_subtract":
+        vc_out = velocity_calculation(sdf_out, 2.2e9, cf_out, **inputs)
+        vc_out_pad = velocity_calculation(sdf_out, 2.2e9, cf_out_pad, **inputs, fft_padding="pad")
+        np.testing.assert_allclose(vc_out_pad["velocity_f_smooth"], vc_out["velocity_f_smooth"], rtol=0, atol=0.1)
+
+
+@pytest.mark.parametrize("real_fft", [False, True])
+def test_fft_padding_on_example_file(valid_inputs, example_sdf_out, real_fft):
+    sdf_out = example_sdf_out
+    inputs = {**valid_inputs, "real_fft": real_fft}
+    cen = carrier_frequency(sdf_out, **inputs)
+    vc_out = velocity_calculation(sdf_out, cen, carrier_filter(sdf_out, cen, **inputs), **inputs)
+    inputs_pad = {**inputs, "fft_padding": "pad"}
+    vc_out_pad = velocity_calculation(sdf_out, cen, carrier_filter(sdf_out, cen, **inputs_pad), **inputs_pad)
+
+    # the notch segment is padded from the signal start, which moves the notch's edge transient there (up to 7.3 m/s,
+    # 3.3 m/s with real_fft). 10 ns after the signal start the velocities agree
+    np.testing.assert_allclose(vc_out_pad["velocity_f_smooth"], vc_out["velocity_f_smooth"], rtol=0, atol=8)
+    later = vc_out["time_f"] > sdf_out["t_start_corrected"] + 10e-9
+    np.testing.assert_allclose(
+        vc_out_pad["velocity_f_smooth"][later], vc_out["velocity_f_smooth"][later], rtol=0, atol=0.03
+    )
+
+
+@pytest.mark.parametrize("fft_padding", ["pad", "trim"])
+def test_fft_padding_carrier_frequency(valid_inputs, sdf_out, fft_padding):
+    inputs = {**valid_inputs, "carrier_band_time": 251.3e-9, "peak_interpolation": "jacobsen"}
+    cen = carrier_frequency(sdf_out, **inputs, fft_padding=fft_padding)
+    assert abs(cen - 2.2e9) < 1e6
+
+
+@pytest.mark.parametrize("carrier_filter_type, fused", [("gaussian_notch", False), ("gaussian_notch", True), ("none", False)])
+def test_roi_velocity_window_matches_full(valid_inputs, sdf_out, carrier_filter_type, fused):
+    inputs = {**valid_inputs, "carrier_filter_type": carrier_filter_type, "fused_spectral_stage": fused}
+    cf_out = carrier_filter(sdf_out, 2.2e9, **inputs)
+
+    vc_out = velocity_calculation(sdf_out, 2.2e9, cf_out, **inputs)
+    vc_out_roi = velocity_calculation(sdf_out, 2.2e9, cf_out, **inputs, velocity_window="roi")
+    np.testing.assert_array_equal(vc_out_roi["time_f"], vc_out["time_f"])
+    np.testing.assert_allclose(vc_out_roi["velocity_f_smooth"], vc_out["velocity_f_smooth"], rtol=0, atol=0.05)
+
+    # voltage_filt only covers the domain of interest plus the derivative and smoothing padding
+    offset = vc_out_roi["voltage_filt_offset"]
+    pad = valid_inputs["smoothing_window"] // 2 + 4
+    assert offset == vc_out["time_start_idx"] - pad
+    assert len(vc_out_roi["voltage_filt"]) == vc_out["time_end_idx"] - vc_out["time_start_idx"] + 2 * pad
+    assert len(vc_out_roi["voltage_filt_early"]) == int(valid_inputs["carrier_band_time"] * sdf_out["fs"])
+
+    # the uncertainty analysis reads the same envelope from the shifted window
+    iua_out = instantaneous_uncertainty_analysis(sdf_out, vc_out, 2.2e9, **inputs)
+    iua_out_roi = instantaneous_uncertainty_analysis(sdf_out, vc_out_roi, 2.2e9, **inputs)
+    np.testing.assert_allclose(iua_out_roi["inst_amp"], iua_out["inst_amp"], rtol=0, atol=2e-2)
+
+    with pytest.raises(ValueError):
+        velocity_calculation(sdf_out, 2.2e9, cf_out, **inputs, velocity_window="doi")
+
+
+def test_carrier_frequency_grid_by_time_axis(valid_inputs, sdf_out):
+    # a measured time column keeps the grid sized from its last carrier band sample, which is one bin short when that
+    # sample falls a hair before (n - 1) / fs. the synthesized time axis uses the grid of the carrier band transform
+    fs = sdf_out["fs"]
+    n = int(round(valid_inputs["carrier_band_time"] * fs))
+    column = {**sdf_out, "time": sdf_out["time"] * (1 - 1e-12)}
+    synthesized = {**sdf_out, "time": TimeAxis(0.0, 1 / fs, len(sdf_out["voltage"]))}
+    assert np.min(np.abs(fftfreq(n - 1, 1 / fs) - carrier_frequency(column, **valid_inputs))) == 0
+    assert np.min(np.abs(fftfreq(n, 1 / fs) - carrier_frequency(synthesized, **valid_inputs))) == 0
+
+
+def sin_func(x, a, b, c, d):
+    return a * np.sin(2 * np.pi * b * x + c) + d
+
+
+def test_sine_fit_linear():
+    fs = 80e9
+    x = np.arange(20000) / fs
+    rng = np.random.default_rng(6)
+    y = sin_func(x, 0.05, 2.2317e9, 1.1, 0.003) + 0.002 * rng.standard_normal(len(x))
+
+    # at the exact frequency the closed form fit recovers the amplitude, phase and offset
+    popt, pcov = sine_fit_linear(x, y, 2.2317e9)
+    assert popt[1] == 2.2317e9
+    np.testing.assert_allclose(popt[[0, 3]], [0.05, 0.003], rtol=0, atol=1e-4)
+    assert popt[2] == pytest.approx(1.1, abs=5e-3)
+    assert pcov.shape == (4, 4)
+
+    # from a nearby frequency, Gauss-Newton steps converge to the curve_fit solution
+    expected, expected_cov = curve_fit(sin_func, x, y, p0=[0.05, 2.23e9, 1.0, 0])
+    popt, pcov = sine_fit_linear(x, y, 2.23e9, steps=3)
+    np.testing.assert_allclose(popt[[0, 1, 3]], expected[[0, 1, 3]], rtol=1e-6)
+    np.testing.assert_allclose(np.sqrt(np.diag(pcov)), np.sqrt(np.diag(expected_cov)), rtol=1e-3)
+    np.testing.assert_allclose(sin_func(x, *popt), sin_func(x, *expected), rtol=0, atol=1e-8)
+
+    # too few points give zeros instead of raising
+    popt, pcov = sine_fit_linear(x[:3], y[:3], 2.23e9)
+    assert not popt.any() and not pcov.any()
@@ -0,0 +1,369 @@
+import pytest
+import numpy as np
+import matplotlib.pyplot as plt
+from alpss.detection.spall_doi_finder import (
+    otsu_top_line,
+    otsu_start_index,
+    otsu_top_line_interpolated,
+    cusum,
+    cusum_batch,
+    cusum_grid,
+    iq_analysis,
+    iq_detection,
+    spall_doi_finder,
+    compare_start_detectors,
+)
+import pandas as pd
+import alpss.spectral
+from scipy.signal import ShortTimeFFT
+from alpss.spectral import PowerSpectrogram, SpectralContext
+from alpss.plotting.iq import plot_iq_detection
+from alpss.carrier.frequency import carrier_frequency
+from alpss.detection.image import gaussian_blur, otsu_threshold, blur_and_threshold, image_backend
+
+
+# the original loops from spall_doi_finder
+def reference_top_line(th3, f_doi):
+    col_len = th3.shape[1]
+    row_len = th3.shape[0]
+    top_line = np.zeros(col_len)
+    f_doi_top_line = np.zeros(col_len)
+    for col_idx in range(col_len):
+        for row_idx in range(row_len):
+            idx_top = row_len - row_idx - 1
+            if th3[idx_top, col_idx] == 255:
+                top_line[col_idx] = idx_top
+                f_doi_top_line[col_idx] = f_doi[idx_top]
+                break
+    f_doi_top_line_clean = f_doi_top_line.copy()
+    f_doi_top_line_clean[np.where(top_line == 0)] = np.nan
+    top_line_clean = top_line.copy()
+    top_line_clean[np.where(top_line == 0)] = np.nan
+    return top_line_clean, f_doi_top_line_clean
+
+
+def reference_start_index(top_line_clean, f_doi_top_line_clean, f_doi_carr_top_idx):
+    highest_idx = np.argmax(f_doi_top_line_clean)
+    for check_idx in range(highest_idx):
+        cidx = highest_idx - check_idx - 1
+        if top_line_clean[cidx] <= f_doi_carr_top_idx:
+            break
+    return cidx
+
+
+def binary_spectrogram(rng, rows=160, cols=600):
+    # a carrier band at rows 40-60 that jumps up to row 120 partway through, with speckle and drop outs
+    th3 = np.zeros((rows, cols), dtype=np.uint8)
+    th3[40:60, :] = 255
+    jump = rng.integers(cols // 4, cols // 2)
+    th3[60 : rng.integers(100, rows), jump:] = 255
+    th3[rng.random((rows, cols)) < 0.02] = 255
+    th3[:, rng.integers(0, cols, 10)] = 0
+    th3[0, rng.integers(0, cols, 5)] = 255
+    return th3
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_otsu_top_line_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    th3 = binary_spectrogram(rng)
+    f_doi = np.linspace(1.5e9, 4e9, th3.shape[0])
+
+    top_line, f_doi_top_line = otsu_top_line(th3, f_doi)
+    expected_top_line, expected_f_doi_top_line = reference_top_line(th3, f_doi)
+    np.testing.assert_array_equal(top_line, expected_top_line)
+    np.testing.assert_array_equal(f_doi_top_line, expected_f_doi_top_line)
+
+    # the start index search, including NaN columns before the highest point
+    for f_doi_carr_top_idx in [0, 45, 59, 100, 159]:
+        assert otsu_start_index(top_line, f_doi_top_line, f_doi_carr_top_idx) == reference_start_index(
+            expected_top_line, expected_f_doi_top_line, f_doi_carr_top_idx
+        )
+
+
+def test_otsu_start_index_highest_point_first():
+    top_line = np.array([10.0, 5.0, 5.0])
+    with pytest.raises(ValueError):
+        otsu_start_index(top_line, top_line * 1e7, 5)
+
+
+# the original cusum recursion
+def reference_cusum(signal, mu0, mu1, sigma, h, k):
+    Z = (signal - mu0) / (np.sqrt(sigma))
+    s = -Z - k
+    G = np.zeros_like(s)
+    for i in range(1, len(s)):
+        G[i] = max(G[i - 1] + s[i], 0)
+        if G[i] > h:
+            S = np.cumsum(s[:i])
+            return i, np.argmin(S), G, s
+    return None, None, G, s
+
+
+def carrier_row(rng, n=1500, change=900):
+    # carrier magnitude that drops once the signal starts
+    signal = 0.5 + 0.02 * rng.standard_normal(n)
+    signal[change:] -= 0.3
+    return signal
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cusum_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    signal = carrier_row(rng)
+    mu0, sigma = np.mean(signal[:300]), np.var(signal[:300])
+
+    for h, k in [(50, 5), (1000, 5), (1e9, 5), (200, 0.5)]:
+        detect_idx, change_idx, G, s = cusum(signal, mu0, 0, sigma, h, k)
+        expected = reference_cusum(signal, mu0, 0, sigma, h, k)
+        assert detect_idx == expected[0] and change_idx == expected[1]
+        np.testing.assert_allclose(G, expected[2], rtol=1e-9, atol=1e-6)
+        np.testing.assert_array_equal(s, expected[3])
+
+
+def test_cusum_batch_and_grid_match_single_runs():
+    rng = np.random.default_rng(7)
+    signals = np.array([carrier_row(rng, change=c) for c in (600, 900, 1200)])
+    signals[2, 1200:] = signals[2, :300].mean()  # no change in the last row
+    mu0, sigma = signals[:, :300].mean(axis=1), signals[:, :300].var(axis=1)
+
+    detect_idx, change_idx, _, _ = cusum_batch(signals, mu0, 0, sigma, 1000, 5)
+    for row in range(3):
+        expected = reference_cusum(signals[row], mu0[row], 0, sigma[row], 1000, 5)
+        assert detect_idx[row] == (-1 if expected[0] is None else expected[0])
+        assert change_idx[row] == (-1 if expected[1] is None else expected[1])
+
+    h = [10, 100, 1000, 1e9]
+    k = [0.5, 5, 20]
+    grid_detect, grid_change = cusum_grid(signals[0], mu0[0], 0, sigma[0], h, k)
+    assert grid_detect.shape == (3, 4)
+    for i, k_i in enumerate(k):
+        for j, h_j in enumerate(h):
+            expected = reference_cusum(signals[0], mu0[0], 0, sigma[0], h_j, k_i)
+            assert grid_detect[i, j] == (-1 if expected[0] is None else expected[0])
+            assert grid_change[i, j] == (-1 if expected[1] is None else expected[1])
+
+
+def iq_trace():
+    # a 2.2 GHz carrier whose amplitude drops by 80% at 1 us
+    fs = 80e9
+    time = np.arange(120000) / fs
+    amplitude = np.where(time < 1e-6, 0.05, 0.01)
+    voltage = amplitude * np.sin(2 * np.pi * 2.2e9 * time)
+    voltage += 0.002 * np.random.default_rng(0).standard_normal(len(time))
+    return fs, time, voltage
+
+
+@pytest.mark.parametrize("decimation", [4, 16, 50])
+def test_decimated_iq_matches_full_rate(decimation):
+    fs, time, voltage = iq_trace()
+    inputs = {"freq_min": 1.5e9, "freq_max": 4e9, "iq_threshold_factor": 0.4}
+
+    t_start, amplitude_full, phase_full = iq_analysis(inputs, voltage, fs, time)
+    t_start_dec, amplitude_dec, phase_dec = iq_analysis({**inputs, "iq_decimation": decimation}, voltage, fs, time)
+
+    # the decimated envelopes are samples of the full rate envelopes
+    np.testing.assert_allclose(amplitude_dec, amplitude_full[::decimation], rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(np.diff(phase_dec), np.diff(phase_full[::decimation]), atol=1e-9)
+
+    # the interpolated crossing is within one decimated sample of the full rate one
+    assert abs(t_start_dec - t_start) <= decimation / fs
+
+
+def test_iq_detection_is_headless():
+    fs, time, voltage = iq_trace()
+    plt.close("all")
+
+    iq_out = iq_detection(voltage, fs, time, freq_min=1.5e9, freq_max=4e9, iq_threshold_factor=0.4)
+    assert plt.get_fignums() == []
+    assert iq_out.carrier_frequency == pytest.approx(2.2e9, rel=1e-3)
+    assert iq_out.t_start_detected == pytest.approx(1e-6, abs=20e-9)
+    assert len(iq_out.time) == len(iq_out.amplitude) == len(iq_out.phase)
+
+    fig = plot_iq_detection(iq_out)
+    assert plt.get_fignums() == [fig.number]
+    plt.close(fig)
+
+
+def test_compare_start_detectors_shares_transforms(valid_inputs, monkeypatch):
+    # a 2.2 GHz carrier that weakens and is joined by a rising doppler shifted signal at 600 ns
+    fs = 80e9
+    time = np.arange(120000) / fs
+    after = time > 600e-9
+    doppler = 2 * np.pi * np.cumsum(2.2e9 + 1.5e9 * np.clip((time - 600e-9) / 50e-9, 0, 1)) / fs
+    voltage = np.where(after, 0.01, 0.05) * np.sin(2 * np.pi * 2.2e9 * time) + after * 0.04 * np.sin(doppler)
+    voltage += 0.002 * np.random.default_rng(0).standard_normal(len(time))
+    data = pd.DataFrame({"Time": time, "Ampl": voltage})
+    inputs = {**valid_inputs, "cusum_threshold": 50}
+
+    calls = []
+    stft = alpss.spectral.stft
+    monkeypatch.setattr(alpss.spectral, "stft", lambda *args, **kwargs: calls.append(1) or stft(*args, **kwargs))
+
+    start_times = compare_start_detectors(data.copy(), **inputs)
+    assert len(calls) == 1
+
+    for detector in ("otsu", "iq", "cusum"):
+        expected = spall_doi_finder(data.copy(), **{**inputs, "start_time_user": detector})["t_start_detected"]
+        assert start_times[detector] == expected
+
+
+def test_sliding_dft_cusum_calculates_no_spectrogram(valid_inputs, monkeypatch):
+    fs, time, voltage = iq_trace()
+    data = pd.DataFrame({"Time": time, "Ampl": voltage})
+    inputs = {**valid_inputs, "start_time_user": "cusum", "cusum_threshold": 50}
+    expected = spall_doi_finder(data.copy(), **inputs)
+
+    def no_stft(*args, **kwargs):
+        raise AssertionError("the spectrogram was calculated")
+
+    with monkeypatch.context() as m:
+        m.setattr(ShortTimeFFT, "stft", no_stft)
+        sdf_out = spall_doi_finder(data.copy(), **inputs, cusum_tracker="sliding_dft")
+        assert "Zxx" in sdf_out and "th3" in sdf_out
+        assert not {"Zxx", "mag", "power", "th3", "power_doi"} & set(sdf_out.keys())
+
+    assert sdf_out["t_start_detected"] == expected["t_start_detected"]
+    np.testing.assert_array_equal(sdf_out["t"], expected["t"])
+    assert sdf_out["t_res"] == expected["t_res"] and sdf_out["f_res"] == expected["f_res"]
+
+    # the deferred outputs are calculated when they are read, e.g. by the plots
+    np.testing.assert_array_equal(sdf_out["Zxx"], expected["Zxx"])
+    np.testing.assert_array_equal(sdf_out["th3"], expected["th3"])
+    np.testing.assert_array_equal(sdf_out.get("power_doi"), expected["power_doi"])
+
+
+def test_otsu_coarse_to_fine_matches_full_spectrogram(valid_inputs):
+    fs = 80e9
+    time = np.arange(120000) / fs
+    after = time > 600e-9
+    doppler = 2 * np.pi * np.cumsum(2.2e9 + 1.5e9 * np.clip((time - 600e-9) / 50e-9, 0, 1)) / fs
+    voltage = np.where(after, 0.01, 0.05) * np.sin(2 * np.pi * 2.2e9 * time) + after * 0.04 * np.sin(doppler)
+    voltage += 0.002 * np.random.default_rng(0).standard_normal(len(time))
+    data = pd.DataFrame({"Time": time, "Ampl": voltage})
+    inputs = {**valid_inputs, "start_time_user": "otsu"}
+
+    full = spall_doi_finder(data.copy(), **inputs)
+    fine = spall_doi_finder(data.copy(), **inputs, otsu_coarse_to_fine=True, coarse_guard_time=50e-9)
+
+    # the fine spectrogram is a window of the full one
+    assert fine["Zxx"].shape[1] < full["Zxx"].shape[1]
+    first = np.flatnonzero(full["t"] == fine["t"][0])[0]
+    np.testing.assert_array_equal(fine["Zxx"], full["Zxx"][:, first : first + len(fine["t"])])
+    assert abs(fine["t_start_detected"] - full["t_start_detected"]) <= full["t_res"]
+
+
+@pytest.mark.parametrize(
+    "ksize, sigma_x, sigma_y",
+    [((5, 5), 0, 0), ((3, 7), 0, 0), ((9, 9), 0, 0), ((5, 3), 1.2, 0), ((7, 5), 0.8, 2.5), ((0, 0), 1.5, 0)],
+)
+def test_numpy_image_backend_matches_opencv(ksize, sigma_x, sigma_y):
+    cv = pytest.importorskip("cv2")
+    rng = np.random.default_rng(sum(ksize))
+    image = rng.integers(0, 256, (97, 143)).astype(np.uint8)
+    image[:40] //= 4
+
+    blur = cv.GaussianBlur(image, ksize, sigma_x, sigmaY=sigma_y)
+    np.testing.assert_array_equal(gaussian_blur(image, ksize, sigma_x, sigma_y), blur)
+
+    ret, th = cv.threshold(blur, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+    ret_np, th_np = otsu_threshold(blur)
+    assert ret_np == ret
+    np.testing.assert_array_equal(th_np, th)
+
+    inputs = {"blur_kernel": ksize, "blur_sigx": sigma_x, "blur_sigy": sigma_y}
+    np.testing.assert_array_equal(
+        blur_and_threshold(image, **inputs, image_backend="numpy"),
+        blur_and_threshold(image, **inputs, image_backend="opencv"),
+    )
+
+
+def test_image_backend_selection():
+    assert image_backend(image_backend="numpy") == "numpy"
+    assert image_backend() in ("opencv", "numpy")
+    with pytest.raises(ValueError):
+        image_backend(image_backend="pillow")
+
+
+def test_power_spectrogram():
+    rng = np.random.default_rng(4)
+    Zxx = rng.standard_normal((64, 200)) + 1j * rng.standard_normal((64, 200))
+    mag = np.abs(Zxx)
+
+    expected = 10 * np.log10(mag**2)
+    np.testing.assert_allclose(PowerSpectrogram(Zxx).values, expected, rtol=1e-12)
+    np.testing.assert_allclose(PowerSpectrogram(magnitude=mag).values, expected, rtol=1e-12)
+    np.testing.assert_array_equal(mag, np.abs(Zxx))
+
+    power32 = PowerSpectrogram(magnitude=mag, dtype="float32")
+    assert power32.values.dtype == np.float32
+    np.testing.assert_allclose(power32[10:20, :5], expected[10:20, :5], rtol=1e-5)
+
+    with pytest.raises(ValueError):
+        PowerSpectrogram()
+
+
+def test_power_spectrogram_shared_with_sdf_out(valid_inputs):
+    fs, time, voltage = iq_trace()
+    data = pd.DataFrame({"Time": time, "Ampl": voltage})
+    spectral = SpectralContext(voltage, fs, **valid_inputs)
+
+    sdf_out = spall_doi_finder(data, spectral=spectral, **{**valid_inputs, "start_time_user": 0.5e-6})
+    assert sdf_out["power"] is spectral.power
+    assert sdf_out["power"].values is spectral.power.values
+    assert np.shares_memory(sdf_out["power_doi"], spectral.power.values)
+
+
+def test_otsu_top_line_interpolated():
+    f_doi = np.linspace(1.5e9, 4e9, 6)
+    blur = np.array(
+        [
+            [200, 200, 0, 200],
+            [200, 150, 0, 200],
+            [100, 100, 0, 200],
+            [20, 50, 0, 200],
+            [0, 0, 0, 200],
+            [0, 0, 0, 200],
+        ],
+        dtype=np.uint8,
+    )
+    th3 = np.where(blur > 60, 255, 0).astype(np.uint8)
+    top_line, f_doi_top_line = otsu_top_line(th3, f_doi)
+
+    interpolated = otsu_top_line_interpolated(blur, 60, top_line, f_doi)
+    df = f_doi[1] - f_doi[0]
+    # the threshold crossing between the top row and the row above it
+    assert interpolated[0] == pytest.approx(f_doi[2] + df * 40 / 80)
+    assert interpolated[1] == pytest.approx(f_doi[2] + df * 40 / 50)
+    # no signal in the column, or no row above the top one
+    assert np.isnan(interpolated[2])
+    assert interpolated[3] == f_doi[-1]
+
+
+def test_compare_start_detectors_logs_failed_detector(valid_inputs, caplog):
+    fs, time, voltage = iq_trace()
+    data = pd.DataFrame({"Time": time, "Ampl": voltage})
+    # a zero threshold is never crossed, so the iq detector finds no start time
+    inputs = {**valid_inputs, "iq_threshold_factor": 0, "cusum_threshold": 50}
+
+    with caplog.at_level("WARNING", logger="alpss"):
+        start_times = compare_start_detectors(data, detectors=("iq", "cusum"), **inputs)
+    assert np.isnan(start_times["iq"])
+    assert np.isfinite(start_times["cusum"])
+    failed = [record for record in caplog.records if "Start time detector iq failed" in record.message]
+    assert [record.name for record in failed] == ["alpss"]
+
+
+def test_cusum_and_carrier_frequency_share_the_carrier_window(valid_inputs):
+    fs, time, voltage = iq_trace()
+    # a time axis just short of the sample times puts one more sample below carrier_band_time than
+    # carrier_band_time * fs
+    data = pd.DataFrame({"Time": time * (1 - 1e-12), "Ampl": voltage})
+    inputs = {**valid_inputs, "start_time_user": "cusum", "cusum_threshold": 50}
+
+    sdf_out = spall_doi_finder(data, **inputs)
+    carrier_frequency(sdf_out, **inputs)
+    spectral = sdf_out["spectral"]
+    n = spectral.carrier_window_length(inputs["carrier_band_time"])
+    assert n == round(inputs["carrier_band_time"] * fs)
+    assert list(spectral._carrier_ffts) == [(n, None)]
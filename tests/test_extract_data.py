@@ -0,0 +1,350 @@
+import pytest
+import os
+import sys
+import struct
+import time as time_module
+import numpy as np
+import pandas as pd
+from alpss.utils import extract_data, read_trc, read_isf, read_wfm
+from alpss.io.csv_index import INDEX_SUFFIX, build_line_index
+from alpss.io.cache import cache_entries, purge
+from alpss.commands import cache_cli
+
+
+@pytest.fixture
+def trace(tmp_path):
+    """Write a short synthetic scope trace as csv and return its path and samples."""
+    rng = np.random.default_rng(0)
+    fs = 80e9
+    n = 5000
+    time = np.arange(n) / fs - 1e-6
+    ampl = 0.05 * np.sin(2 * np.pi * 2.2e9 * time) + 0.003 * rng.standard_normal(n)
+
+    path = tmp_path / "trace.csv"
+    with open(path, "w") as fh:
+        fh.write("Time,Ampl\n")
+        np.savetxt(fh, np.column_stack([time, ampl]), delimiter=",", fmt="%.17g")
+    return path, time, ampl
+
+
+@pytest.fixture
+def window_inputs(trace):
+    path, _, _ = trace
+    return {
+        "filepath": str(path),
+        "header_lines": 1,
+        "sample_rate": 80e9,
+        "time_to_skip": 10e-9,
+        "time_to_take": 25e-9,
+    }
+
+
+def test_npy_matches_csv(tmp_path, trace, window_inputs):
+    _, time, ampl = trace
+    expected = extract_data(window_inputs)
+
+    npy_path = tmp_path / "trace.npy"
+    np.save(npy_path, np.column_stack([time, ampl]))
+    data = extract_data({**window_inputs, "filepath": str(npy_path)})
+
+    np.testing.assert_allclose(data.to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+
+def test_raw_amplitude_only_synthesizes_time(tmp_path, trace, window_inputs):
+    _, _, ampl = trace
+    expected = extract_data(window_inputs)
+
+    raw_path = tmp_path / "trace.f64"
+    ampl.astype(np.float64).tofile(raw_path)
+    data = extract_data({**window_inputs, "filepath": str(raw_path)})
+
+    np.testing.assert_allclose(data["Ampl"].to_numpy(), expected.iloc[:, 1].to_numpy(), rtol=1e-12)
+    np.testing.assert_allclose(np.diff(data["Time"].to_numpy()), 1 / 80e9, rtol=1e-9)
+
+
+def test_raw_interleaved_float32_bytestring(trace, window_inputs):
+    _, time, ampl = trace
+    expected = extract_data(window_inputs)
+
+    raw = np.column_stack([time, ampl]).astype(np.float32).tobytes()
+    inputs = {**window_inputs, "filepath": "upload.bin", "bytestring": raw, "binary_columns": 2}
+    data = extract_data(inputs)
+
+    assert len(data) == len(expected)
+    np.testing.assert_allclose(data["Ampl"].to_numpy(), expected.iloc[:, 1].to_numpy(), rtol=1e-6, atol=1e-9)
+
+
+def test_invalid_binary_columns(tmp_path, trace, window_inputs):
+    _, _, ampl = trace
+    raw_path = tmp_path / "trace.bin"
+    ampl.astype(np.float32).tofile(raw_path)
+
+    with pytest.raises(ValueError):
+        extract_data({**window_inputs, "filepath": str(raw_path), "binary_columns": 3})
+
+
+def test_csv_index_matches_skiprows(trace, window_inputs):
+    path, _, _ = trace
+    expected = extract_data(window_inputs)
+
+    inputs = {**window_inputs, "csv_index": True, "csv_index_stride": 7}
+    data = extract_data(inputs)
+    assert os.path.exists(str(path) + INDEX_SUFFIX)
+
+    pd.testing.assert_frame_equal(data, expected)
+
+    # a second window reuses the sidecar built by the first call
+    inputs["time_to_skip"] = 30e-9
+    pd.testing.assert_frame_equal(
+        extract_data(inputs), extract_data({**window_inputs, "time_to_skip": 30e-9})
+    )
+
+
+def test_csv_index_rebuilt_when_file_changes(trace, window_inputs):
+    path, _, _ = trace
+    inputs = {**window_inputs, "csv_index": True, "csv_index_stride": 16}
+    extract_data(inputs)
+
+    # rewrite the file with an extra header line so every stored offset is stale
+    text = open(path).read()
+    with open(path, "w") as fh:
+        fh.write("# scope export\n" + text)
+    os.utime(path, ns=(0, 123456789))
+
+    expected = extract_data({**window_inputs, "header_lines": 2})
+    data = extract_data({**inputs, "header_lines": 2})
+    pd.testing.assert_frame_equal(data, expected)
+
+
+def test_build_line_index_offsets(tmp_path):
+    path = tmp_path / "lines.csv"
+    lines = [f"{i},{i * 2}\n" for i in range(50)]
+    path.write_text("".join(lines))
+
+    offsets = build_line_index(str(path), stride=5, chunk_size=16)
+    expected = np.cumsum([0] + [len(line) for line in lines])[::5]
+    np.testing.assert_array_equal(offsets, expected)
+
+
+def _write_trc(path, codes, gain, offset, dt, t0, little=True):
+    """Encode int16 codes as a LeCroy trc file with a '#9' block prefix and one trigger time entry."""
+    e = "<" if little else ">"
+    desc = bytearray(346)
+    desc[0:8] = b"WAVEDESC"
+    desc[16:26] = b"LECROY_2_3"
+    struct.pack_into(e + "hh", desc, 32, 1, 1 if little else 0)
+    struct.pack_into(e + "7l", desc, 36, 346, 0, 0, 16, 0, 0, codes.size * 2)
+    struct.pack_into(e + "l", desc, 116, codes.size)
+    struct.pack_into(e + "2f", desc, 156, gain, offset)
+    struct.pack_into(e + "f", desc, 176, dt)
+    struct.pack_into(e + "d", desc, 180, t0)
+    body = bytes(desc) + b"\x00" * 16 + codes.astype(e + "i2").tobytes()
+    with open(path, "wb") as fh:
+        fh.write(b"#9%09d" % len(body) + body)
+
+
+def _write_isf(path, codes, ymult, yoff, yzero, dt, t0):
+    """Encode int16 codes as a big endian Tektronix isf file."""
+    data = codes.astype(">i2").tobytes()
+    header = (
+        ':WFMPRE:BYT_NR 2;BIT_NR 16;ENCDG BIN;BN_FMT RI;BYT_OR MSB;'
+        f'WFID "Ch1, DC coupling; synthetic";NR_PT {codes.size};PT_FMT Y;XUNIT "s";'
+        f'XINCR {dt!r};XZERO {t0!r};PT_OFF 0;YUNIT "V";YMULT {ymult!r};YOFF {yoff!r};YZERO {yzero!r};'
+        f':CURVE #{len(str(len(data)))}{len(data)}'
+    )
+    with open(path, "wb") as fh:
+        fh.write(header.encode() + data + b"\n")
+
+
+def _write_wfm(path, codes, vscale, voffset, dt, t0, precharge=16, postcharge=16):
+    """Encode int16 codes as a little endian Tektronix WFM#003 file with pre/postcharge points."""
+    header = bytearray(838)
+    struct.pack_into("<H", header, 0, 0x0F0F)
+    header[2:10] = b":WFM#003"
+    header[15] = 2
+    struct.pack_into("<l", header, 16, 838)
+    struct.pack_into("<2d", header, 168, vscale, voffset)
+    struct.pack_into("<l", header, 240, 0)
+    struct.pack_into("<2d", header, 488, dt, t0)
+    npts = precharge + codes.size + postcharge
+    struct.pack_into("<5L", header, 818, 0, precharge * 2, (precharge + codes.size) * 2, npts * 2, npts * 2)
+    curve = np.concatenate([np.full(precharge, 99), codes, np.full(postcharge, -99)]).astype("<i2")
+    with open(path, "wb") as fh:
+        fh.write(bytes(header) + curve.tobytes())
+
+
+@pytest.fixture
+def codes():
+    rng = np.random.default_rng(1)
+    return rng.integers(-30000, 30000, 4000).astype(np.int16)
+
+
+@pytest.mark.parametrize("little", [True, False])
+def test_read_trc(tmp_path, codes, little):
+    path = tmp_path / "C1trace.trc"
+    _write_trc(path, codes, 2.5e-5, 0.01, 1.25e-11, -1e-6, little=little)
+
+    trace = read_trc(str(path))
+    assert len(trace) == codes.size
+    assert trace.dt == pytest.approx(1.25e-11)
+    assert trace.t0 == pytest.approx(-1e-6)
+    expected = codes * np.float64(np.float32(2.5e-5)) - np.float64(np.float32(0.01))
+    np.testing.assert_allclose(trace.voltage(), expected, rtol=1e-12)
+
+
+def test_read_isf(tmp_path, codes):
+    path = tmp_path / "tek0000.isf"
+    _write_isf(path, codes, 1.5625e-6, 12.0, 0.002, 1.25e-11, -1e-6)
+
+    trace = read_isf(str(path))
+    assert len(trace) == codes.size
+    assert trace.dt == 1.25e-11
+    np.testing.assert_allclose(trace.voltage(), (codes - 12.0) * 1.5625e-6 + 0.002, rtol=1e-12)
+
+
+def test_read_wfm(tmp_path, codes):
+    path = tmp_path / "tek0000.wfm"
+    _write_wfm(path, codes, 3.0e-6, -0.004, 1.25e-11, -1e-6)
+
+    trace = read_wfm(str(path))
+    assert len(trace) == codes.size
+    np.testing.assert_allclose(trace.voltage(), codes * 3.0e-6 - 0.004, rtol=1e-12)
+
+
+def test_read_wfm_rejects_other_files(tmp_path):
+    path = tmp_path / "bad.wfm"
+    path.write_bytes(b"\x00" * 900)
+    with pytest.raises(ValueError):
+        read_wfm(str(path))
+
+
+@pytest.mark.parametrize("ext", [".trc", ".isf", ".wfm"])
+def test_extract_data_reads_scope_files(tmp_path, codes, ext):
+    path = tmp_path / f"trace{ext}"
+    writers = {
+        ".trc": lambda: _write_trc(path, codes, 2.5e-5, 0.0, 1.25e-11, 0.0),
+        ".isf": lambda: _write_isf(path, codes, 2.5e-5, 0.0, 0.0, 1.25e-11, 0.0),
+        ".wfm": lambda: _write_wfm(path, codes, 2.5e-5, 0.0, 1.25e-11, 0.0),
+    }
+    writers[ext]()
+
+    inputs = {
+        "filepath": str(path),
+        "header_lines": 0,
+        "sample_rate": 80e9,
+        "time_to_skip": 10e-9,
+        "time_to_take": 25e-9,
+    }
+    data = extract_data(inputs)
+
+    first = int(10e-9 / (1 / 80e9)) + 1
+    assert list(data.columns) == ["Time", "Ampl"]
+    assert len(data) == int(25e-9 / (1 / 80e9))
+    np.testing.assert_allclose(
+        data["Ampl"].to_numpy(), codes[first : first + len(data)] * np.float64(np.float32(2.5e-5)), rtol=1e-6
+    )
+    np.testing.assert_allclose(np.diff(data["Time"].to_numpy()), 1.25e-11, rtol=1e-6)
+
+    # the same decoding works on an in-memory upload
+    upload = extract_data({**inputs, "bytestring": path.read_bytes()})
+    pd.testing.assert_frame_equal(upload, data)
+
+
+def test_trace_cache_hit_matches_csv(tmp_path, trace, window_inputs, monkeypatch):
+    expected = extract_data(window_inputs)
+    inputs = {**window_inputs, "trace_cache": True, "cache_dir": str(tmp_path / "cache")}
+
+    data = extract_data(inputs)
+    np.testing.assert_array_equal(data.to_numpy(), expected.to_numpy())
+    assert len(cache_entries(str(tmp_path / "cache"))) == 1
+
+    # later calls load the cached columns without parsing the csv again, for any window
+    def no_parse(*args, **kwargs):
+        raise AssertionError("csv parsed despite a cache hit")
+
+    monkeypatch.setattr("alpss.io.cache.pd.read_csv", no_parse)
+    shifted = extract_data({**inputs, "time_to_skip": 30e-9})
+    monkeypatch.undo()
+    np.testing.assert_array_equal(
+        shifted.to_numpy(), extract_data({**window_inputs, "time_to_skip": 30e-9}).to_numpy()
+    )
+
+
+def test_trace_cache_lru_eviction(tmp_path, trace, window_inputs):
+    path, time, ampl = trace
+    cache = str(tmp_path / "cache")
+    inputs = {**window_inputs, "trace_cache": True, "cache_dir": cache}
+    extract_data(inputs)
+    (first_entry, size, _), = cache_entries(cache)
+
+    # a second trace with different content pushes the cache over a cap that only fits one entry
+    other = tmp_path / "other.csv"
+    with open(other, "w") as fh:
+        fh.write("Time,Ampl\n")
+        np.savetxt(fh, np.column_stack([time, -ampl]), delimiter=",", fmt="%.17g")
+    extract_data({**inputs, "filepath": str(other), "cache_max_bytes": size + size // 2})
+
+    remaining = [entry for entry, _, _ in cache_entries(cache)]
+    assert len(remaining) == 1 and remaining[0] != first_entry
+
+    assert len(purge(cache)) == 1
+    assert cache_entries(cache) == []
+
+
+def cache_with_entries(path, ages_in_days):
+    """Write one equal-sized cache entry per age and return their paths, oldest first."""
+    os.makedirs(path)
+    entries = []
+    for i, age in enumerate(sorted(ages_in_days, reverse=True)):
+        entry = os.path.join(path, f"{i:032x}.npy")
+        np.save(entry, np.zeros((100, 2)))
+        used = time_module.time() - age * 86400
+        os.utime(entry, (used, used))
+        entries.append(entry)
+    return entries
+
+
+def test_cache_purge_applies_age_then_size(tmp_path):
+    cache = str(tmp_path / "cache")
+    old, recent, newest = cache_with_entries(cache, [10, 1, 0])
+    size = os.path.getsize(old)
+
+    # a size cap that fits every entry does not override the age filter
+    assert purge(cache, older_than=5 * 86400, max_bytes=10 * size) == [old]
+
+    # after the age filter, least recently used entries go until the cache fits
+    cache = str(tmp_path / "second")
+    cache_with_entries(cache, [10, 1, 0])
+    removed = purge(cache, older_than=5 * 86400, max_bytes=size + size // 2)
+    assert [os.path.basename(entry) for entry in removed] == [os.path.basename(old), os.path.basename(recent)]
+    assert [os.path.basename(entry) for entry, _, _ in cache_entries(cache)] == [os.path.basename(newest)]
+
+
+def test_cache_cli_info_and_purge(tmp_path, monkeypatch, capsys):
+    cache = str(tmp_path / "cache")
+    old, recent, newest = cache_with_entries(cache, [10, 1, 0])
+
+    monkeypatch.setattr(sys, "argv", ["alpss-cache", "--cache-dir", cache, "info"])
+    cache_cli()
+    out = capsys.readouterr().out
+    assert f"cache directory: {cache}" in out
+    assert "3 entries" in out
+    assert all(os.path.basename(entry) in out for entry in (old, recent, newest))
+
+    monkeypatch.setattr(sys, "argv", ["alpss-cache", "--cache-dir", cache, "purge", "--older-than", "5"])
+    cache_cli()
+    assert capsys.readouterr().out.strip() == f"removed 1 entries from {cache}"
+    assert [entry for entry, _, _ in cache_entries(cache)] == [recent, newest]
+
+    monkeypatch.setattr(sys, "argv", ["alpss-cache", "--cache-dir", cache, "purge"])
+    cache_cli()
+    assert capsys.readouterr().out.strip() == f"removed 2 entries from {cache}"
+    assert cache_entries(cache) == []
+
+
+def test_synthesized_time_axis_reads_amplitude_only(trace, window_inputs):
+    expected = extract_data(window_inputs)
+    data = extract_data({**window_inputs, "time_axis": "synthesized"})
+
+    assert data.shape == (len(expected), 1)
+    np.testing.assert_array_equal(data.iloc[:, 0].to_numpy(), expected.iloc[:, 1].to_numpy())
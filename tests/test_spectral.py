@@ -0,0 +1,119 @@
+import pytest
+import numpy as np
+from scipy.fft import get_workers, next_fast_len
+from scipy.signal import ShortTimeFFT
+from alpss.spectral import (
+    stft,
+    stft_bin,
+    stft_plan,
+    fft_workers,
+    fft_length,
+    previous_fast_len,
+    fft_frequencies,
+)
+
+
+class TestStftPlanCache:
+    inputs = {"window": "hann", "nperseg": 64, "noverlap": 48, "nfft": 128}
+
+    def test_plan_reused(self):
+        assert stft_plan(1e9, **self.inputs) is stft_plan(1e9, **self.inputs)
+        assert stft_plan(1e9, **self.inputs) is not stft_plan(2e9, **self.inputs)
+        assert stft_plan(1e9, **{**self.inputs, "window": ["gaussian", 8]}) is stft_plan(
+            1e9, **{**self.inputs, "window": ("gaussian", 8)}
+        )
+
+    def test_matches_uncached_legacy_crop(self):
+        rng = np.random.default_rng(0)
+        voltage = rng.standard_normal(5000)
+        fs = 1e9
+
+        SFT = ShortTimeFFT.from_window(
+            "hann", fs=fs, nperseg=64, noverlap=48, mfft=128, scale_to="magnitude", phase_shift=None
+        )
+        Sx_full = SFT.stft(voltage, padding="zeros")
+        t_full = SFT.t(len(voltage))
+        t_legacy = np.arange(32, len(voltage) - 32 + 1, 16) / fs
+        t_idx = np.argmin(np.abs(t_full - t_legacy[0]))
+
+        for _ in range(2):
+            f, t, Zxx = stft(voltage, fs, **self.inputs)
+            np.testing.assert_array_equal(f, SFT.f)
+            np.testing.assert_array_equal(t, t_full[t_idx : t_idx + len(t_legacy)])
+            np.testing.assert_array_equal(Zxx, Sx_full[:, t_idx : t_idx + len(t_legacy)])
+
+        # the returned time array is a copy of the cached one
+        t -= 1.0
+        np.testing.assert_array_equal(stft(voltage, fs, **self.inputs)[1], t_full[t_idx : t_idx + len(t_legacy)])
+
+
+@pytest.mark.parametrize("window, nperseg, noverlap", [("hann", 512, 435), (("gaussian", 50), 511, 400), ("hamming", 100, 0)])
+def test_band_limited_stft_matches_full_band(window, nperseg, noverlap):
+    rng = np.random.default_rng(1)
+    voltage = rng.standard_normal(5001)
+    fs = 80e9
+    inputs = {
+        "window": window,
+        "nperseg": nperseg,
+        "noverlap": noverlap,
+        "nfft": 5120,
+        "freq_min": 1.5e9,
+        "freq_max": 4e9,
+    }
+
+    f, t, Zxx = stft(voltage, fs, **inputs)
+    f_band, t_band, Zxx_band = stft(voltage, fs, **inputs, stft_band_limited=True)
+
+    # the band holds the bins the callers slice out of the full spectrogram, including the freq_max bin
+    lo = np.argmin(np.abs(f - inputs["freq_min"]))
+    hi = np.argmin(np.abs(f - inputs["freq_max"]))
+    np.testing.assert_array_equal(f_band, f[lo : hi + 1])
+    np.testing.assert_array_equal(t_band, t)
+    np.testing.assert_allclose(Zxx_band, Zxx[lo : hi + 1], rtol=0, atol=1e-12)
+
+
+def test_fft_workers():
+    assert fft_workers() == get_workers()
+    assert fft_workers(fft_workers=4) == 4
+
+    voltage = np.random.default_rng(2).standard_normal(5000)
+    inputs = {"window": "hann", "nperseg": 64, "noverlap": 48, "nfft": 128}
+    np.testing.assert_array_equal(stft(voltage, 1e9, **inputs)[2], stft(voltage, 1e9, **inputs, fft_workers=2)[2])
+
+
+@pytest.mark.parametrize("window", ["hann", "hamming", "blackman", "boxcar", ("kaiser", 8)])
+def test_stft_bin_matches_stft_row(window):
+    # cosine-sum windows use the sliding dft, the kaiser window the per-frame dft
+    fs = 80e9
+    rng = np.random.default_rng(3)
+    voltage = np.sin(2 * np.pi * 2.23e9 * np.arange(20000) / fs) + 0.1 * rng.standard_normal(20000)
+    inputs = {"window": window, "nperseg": 512, "noverlap": 435, "nfft": 5120}
+
+    f, t, Zxx = stft(voltage, fs, **inputs)
+    f_k, t_k, Zxx_k = stft_bin(voltage, fs, 2.231e9, **inputs)
+
+    k = np.argmin(np.abs(f - 2.231e9))
+    assert f_k == f[k]
+    np.testing.assert_array_equal(t_k, t)
+    np.testing.assert_allclose(Zxx_k, Zxx[k], rtol=0, atol=1e-13)
+
+
+def test_fft_frequencies():
+    fs = 80e9
+    assert fft_frequencies(1000, fs) is fft_frequencies(1000, fs)
+    np.testing.assert_array_equal(fft_frequencies(1000, fs), np.fft.fftfreq(1000, 1 / fs))
+    np.testing.assert_array_equal(fft_frequencies(1000, fs, real=True), np.fft.rfftfreq(1000, 1 / fs))
+    with pytest.raises(ValueError):
+        fft_frequencies(1000, fs)[0] = 1.0
+
+
+def test_fft_length():
+    # 59999 has no prime factor below 300
+    assert fft_length(59999) == 59999
+    assert fft_length(59999, fft_padding="pad") == next_fast_len(59999)
+    assert fft_length(59999, real=True, fft_padding="pad") == next_fast_len(59999, True)
+    assert fft_length(59999, fft_padding="trim") == next_fast_len(59999)
+    assert fft_length(59999, real=True, trim=True, fft_padding="trim") == previous_fast_len(59999, True) == 59049
+    assert fft_length(60000, trim=True, fft_padding="trim") == 60000
+    with pytest.raises(ValueError):
+        fft_length(59999, fft_padding="shrink")
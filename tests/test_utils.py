@@ -0,0 +1,27 @@
+import pytest
+import numpy as np
+from alpss.utils import TimeAxis, nearest_index
+
+
+class TestTimeAxis:
+    def test_matches_materialized_array(self):
+        axis = TimeAxis(0.0, 1 / 80e9, 1000)
+        full = np.arange(1000) / 80e9
+
+        assert len(axis) == 1000
+        assert axis[0] == 0.0
+        assert axis[-1] == pytest.approx(full[-1], rel=1e-15)
+        np.testing.assert_allclose(axis[10:20], full[10:20], rtol=1e-15)
+        np.testing.assert_allclose(np.asarray(axis), full, rtol=1e-15)
+        np.testing.assert_allclose(axis / 1e-9, full / 1e-9, rtol=1e-15)
+        assert np.count_nonzero(axis < 2.5e-9) == np.count_nonzero(full < 2.5e-9)
+
+    def test_index_out_of_bounds(self):
+        with pytest.raises(IndexError):
+            TimeAxis(0.0, 1.0, 5)[5]
+
+    def test_nearest_index_matches_argmin(self):
+        axis = TimeAxis(0.0, 1 / 80e9, 1000)
+        full = np.asarray(axis)
+        for t in [-1e-9, 0.0, 3.3e-9, 5.01e-9, 1e-6]:
+            assert nearest_index(axis, t) == nearest_index(full, t) == np.argmin(np.abs(full - t))